@@ -1,39 +1,288 @@
+import io
 import os
-from flask import Flask, request, abort, jsonify
+from flask import (
+    Flask,
+    Response,
+    current_app,
+    request,
+    abort,
+    jsonify,
+    stream_with_context,
+)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from random import shuffle
-
-
-from models import setup_db, Question, Category
+from sqlalchemy import func
+
+
+from models import (
+    setup_db,
+    get_pool_stats,
+    read_only,
+    Player,
+    Question,
+    QuestionStat,
+    Category,
+)
+from .admission import admission_control
+from .answers import answer_checker
+from .bulk import ImportFailed, export_questions, import_questions, questions_cli
+from .categories import category_registry
+from .compression import compression
+from .counters import question_counter
+from .http_cache import conditional, content_revision
+from .instrumentation import instrumentation
+from .quiz_generator import InvalidQuizSpec, quiz_generator
+from .quiz_sessions import quiz_sessions
+from .response_cache import response_cache
+from .scores import ALL_CATEGORIES, scores
+from .search import question_search
+from .serialization import project_questions, response_encoder
+from .snapshot import question_snapshot, questions_by_id
 
 QUESTIONS_PER_PAGE = 10
+MAX_BATCH_SIZE = 100
 
 # Helper functions
 def pagination_questions(request, selection):
     """
-    This function is used to paginate the questions into chunks each of ten quesions
+    This function is used to paginate the questions into chunks each of ten quesions,
+    the page is fetched from the database with LIMIT/OFFSET so only ten rows are loaded.
+    For deep pages the client can pass `after_id` (the id of the last question it has)
+    to use the keyset cursor instead of the offset. Only the columns of the questions
+    are read, without loading ORM objects
     """
     page = request.args.get("page", 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    formatted_questions = [question.format() for question in selection]
-    return formatted_questions[start:end]
+    after_id = request.args.get("after_id", None, type=int)
+    selection = selection.order_by(Question.id)
+    if after_id is not None:
+        selection = selection.filter(Question.id > after_id)
+    elif page < 1:
+        return []
+    else:
+        selection = selection.offset((page - 1) * QUESTIONS_PER_PAGE)
+    return project_questions(selection.limit(QUESTIONS_PER_PAGE))
+
+
+def pagination_snapshot(request, category=None):
+    """
+    This function is used to paginate the questions of the category, or all the
+    questions, from the question snapshot as pagination_questions does from the database
+    """
+    page = request.args.get("page", 1, type=int)
+    after_id = request.args.get("after_id", None, type=int)
+    return question_snapshot.get().page(category, page, after_id, QUESTIONS_PER_PAGE)
+
+
+def count_questions(selection):
+    """
+    This function is used to count the questions of a query with a single COUNT
+    without loading the rows
+    """
+    return selection.order_by(None).with_entities(func.count(Question.id)).scalar()
+
+
+def wants_minimal_response(request, default=None):
+    """
+    This function is used to know if the client of a write asked for the minimal response,
+    with `?return=minimal` or a `Prefer: return=minimal` header. Otherwise the default of
+    the endpoint or the WRITE_RESPONSE_DEFAULT config decides, "representation" unless
+    configured
+    """
+    preference = request.args.get("return")
+    if preference is None:
+        for token in request.headers.get("Prefer", "").split(","):
+            name, _, value = token.strip().partition("=")
+            if name == "return":
+                preference = value
+    if preference is None:
+        preference = default
+    if preference is None:
+        preference = current_app.config.get("WRITE_RESPONSE_DEFAULT", "representation")
+    return preference == "minimal"
+
+
+def write_response(request, result, default=None):
+    """
+    This function is used to build the response of a question write, the minimal response
+    only has the result and the total number of questions kept by the counter, the full
+    response adds the requested page of questions
+    """
+    result["success"] = True
+    result["total_questions"] = question_counter.get(content_revision("questions"))
+    if wants_minimal_response(request, default):
+        response = response_encoder.jsonify(result)
+        response.headers["Preference-Applied"] = "return=minimal"
+        return response
+    result["questions"] = pagination_questions(request, Question.query)
+    return response_encoder.jsonify(result)
+
+
+def get_quiz_category(quiz_category):
+    """
+    This function is used to get the category id of the quiz category, None for all
+    the questions when its id is 0. Aborts with bad request for an invalid category
+    """
+    category_id = quiz_category.get("id", None)
+
+    if category_id == None:
+        abort(400)
+    elif category_id != 0:
+        # Then it is one of the categories
+        category = category_registry.get_id(quiz_category.get("type"))
+
+        if not category:
+            abort(400)
+        return category
+    else:
+        # then All is selected
+        return None
+
+
+def get_quiz_selection(quiz_category):
+    """
+    This function is used to get the query of the questions of the quiz category,
+    all the questions when its id is 0. Aborts with bad request for an invalid category
+    """
+    category = get_quiz_category(quiz_category)
+    if category is None:
+        return Question.query
+    return Question.query.filter(Question.category == category)
+
+
+def get_previous_questions(previous_questions):
+    """
+    This function is used to read the ids of the previous questions of a quiz as a set,
+    aborts with bad request unless they are a list of integers
+    """
+    if previous_questions is None:
+        return set()
+    if not isinstance(previous_questions, list):
+        abort(400)
+    try:
+        return {int(question_id) for question_id in previous_questions}
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def get_next_question(category, previous_questions):
+    """
+    This function is used to get a random quesion of the category not in the previous
+    questions, None when the user has got all the questions
+    """
+    questions, _ = get_next_questions(category, previous_questions, 1)
+    return questions[0] if questions else None
+
+
+def get_next_questions(category, previous_questions, count):
+    """
+    This function is used to get `count` random questions of the category not in the
+    previous questions, their ids are drawn from the question ids held in memory by the
+    quiz generator so only the chosen questions are read, in one query. Returns the
+    questions and the number of questions left
+    """
+    question_ids, remaining = quiz_generator.sample(category, previous_questions, count)
+    questions = questions_by_id(question_ids)
+    if len(questions) < len(question_ids):
+        # deleted by another worker since the ids were loaded
+        quiz_generator.invalidate()
+        question_ids, remaining = quiz_generator.sample(
+            category, previous_questions, count
+        )
+        questions = questions_by_id(question_ids)
+    return questions, remaining
+
+
+def get_quiz_from_snapshot(body, quiz_category, previous_questions):
+    """
+    This function is used to answer POST /quizzes from the question snapshot, the
+    previous questions are left out of the ids of the category held in memory
+    """
+    category = get_quiz_category(quiz_category)
+    previous_questions = get_previous_questions(previous_questions)
+    count = 1
+    if "count" in body:
+        count = get_batch_size(body["count"])
+        if count is None:
+            abort(400)
+    questions, remaining_questions = question_snapshot.get().sample(
+        category, previous_questions, count
+    )
+    if "count" in body:
+        return response_encoder.jsonify(
+            {
+                "success": True,
+                "questions": quiz_questions(questions),
+                "remaining_questions": remaining_questions,
+            }
+        )
+    # The user has got all the questions
+    if not questions:
+        return jsonify({"success": True})
+    return jsonify({"success": True, "question": quiz_questions(questions)[0]})
+
+
+def quiz_questions(questions):
+    """
+    This function is used to leave the answers out of the questions of a quiz when
+    QUIZ_INCLUDE_ANSWERS is off, the players then send their answers to
+    POST /quizzes/answer to have them checked
+    """
+    if current_app.config.get("QUIZ_INCLUDE_ANSWERS", True):
+        return questions
+    return [
+        {field: value for field, value in question.items() if field != "answer"}
+        for question in questions
+    ]
 
 
-def get_next_question(questions, previous_questions):
+def get_batch_size(value):
     """
-    This function is used to get a new quesion not in the previous questions
+    This function is used to validate the number of questions asked by a batch request,
+    returns None unless it is an integer from 1 to MAX_BATCH_SIZE
     """
-    for question in questions:
-        if question.id not in previous_questions:
-            return question
+    if isinstance(value, bool):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if 1 <= value <= MAX_BATCH_SIZE else None
+
+
+def get_batch_ids(body):
+    """
+    This function is used to read the `ids` of a batch request, returns None unless
+    it is a list of 1 to MAX_BATCH_SIZE question ids
+    """
+    ids = (body or {}).get("ids")
+    if not isinstance(ids, list) or get_batch_size(len(ids)) is None:
+        return None
+    try:
+        return list(dict.fromkeys(int(question_id) for question_id in ids))
+    except (TypeError, ValueError):
+        return None
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
     setup_db(app)
+    category_registry.init_app(app)
+    question_search.init_app(app)
+    question_counter.init_app(app)
+    quiz_sessions.init_app(app)
+    quiz_generator.init_app(app)
+    response_cache.init_app(app)
+    answer_checker.init_app(app)
+    scores.init_app(app)
+    instrumentation.init_app(app)
+    response_encoder.init_app(app)
+    question_snapshot.init_app(app)
+    compression.init_app(app)
+    admission_control.init_app(app)
+    app.cli.add_command(questions_cli)
     # Configure the CORS
     CORS(app)
 
@@ -63,17 +312,17 @@ def create_app(test_config=None):
   """
 
     @app.route("/categories")
+    @admission_control.limited
+    @read_only
+    @conditional("categories")
+    @response_cache.cached("categories")
     def get_categories():
-        all_categories = Category.query.all()
+        categories = category_registry.all()
         # if there is no categories, will return not found
-        if len(all_categories) == 0:
+        if len(categories) == 0:
             abort(404)
-        # categories = [category.type for category in all_categories]
-        categories = {}
-        for category in all_categories:
-            categories[category.id] = category.type
 
-        return jsonify({"success": True, "categories": categories})
+        return response_encoder.jsonify({"success": True, "categories": categories})
 
     """
   @TODO: 
@@ -89,31 +338,36 @@ def create_app(test_config=None):
   """
 
     @app.route("/questions")
+    @admission_control.limited
+    @read_only
+    @conditional("questions", "categories")
+    @response_cache.cached("questions", "categories")
+    @admission_control.coalesced("questions", "categories")
     def get_questions():
         # Get the Questions
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = pagination_questions(request, selection)
+        if question_snapshot.enabled:
+            current_questions = pagination_snapshot(request)
+            total_questions = question_snapshot.get().count()
+        else:
+            current_questions = pagination_questions(request, Question.query)
+            total_questions = question_counter.get(content_revision("questions"))
         # In case no questions shall return not found
         if len(current_questions) == 0:
             abort(404)
 
         # Get the Categories
-        all_categories = Category.query.all()
+        categories = category_registry.all()
         # If there is no categories, will return not found
-        if len(all_categories) == 0:
+        if len(categories) == 0:
             abort(404)
-        # categories = [category.type for category in all_categories]
-        categories = {}
-        for category in all_categories:
-            categories[category.id] = category.type
 
         # Assumed the current category is the first category
         current_category = categories[1]
-        return jsonify(
+        return response_encoder.jsonify(
             {
                 "success": True,
                 "questions": current_questions,
-                "total_questions": len(selection),
+                "total_questions": total_questions,
                 "current_category": current_category,
                 "categories": categories,
             }
@@ -128,6 +382,7 @@ def create_app(test_config=None):
   """
 
     @app.route("/questions/<int:question_id>", methods=["DELETE"])
+    @admission_control.limited
     def delete_question(question_id):
         """
       This API is used to delete the question
@@ -137,19 +392,43 @@ def create_app(test_config=None):
             if question == None:
                 abort(404)
             question.delete()
-            selection = Question.query.order_by(Question.id).all()
-            current_questions = pagination_questions(request, selection)
-            return jsonify(
-                {
-                    "success": True,
-                    "deleted": question.id,
-                    "questions": current_questions,
-                    "total_questions": len(selection),
-                }
-            )
+            return write_response(request, {"deleted": question.id})
         except:
             abort(422)
 
+    @app.route("/stats")
+    @admission_control.limited
+    @read_only
+    @conditional("questions", "categories")
+    @response_cache.cached("questions", "categories")
+    @admission_control.coalesced("questions", "categories")
+    def get_stats():
+        """
+      This API is used to get the number of questions of each category and of each
+      difficulty, read from the counters kept up to date by the question writes
+      """
+        questions_per_category = {
+            category_id: 0 for category_id in category_registry.all()
+        }
+        questions_per_difficulty = {}
+        total_questions = 0
+        for stat in QuestionStat.query:
+            questions_per_category[stat.category] = (
+                questions_per_category.get(stat.category, 0) + stat.questions
+            )
+            questions_per_difficulty[stat.difficulty] = (
+                questions_per_difficulty.get(stat.difficulty, 0) + stat.questions
+            )
+            total_questions += stat.questions
+        return response_encoder.jsonify(
+            {
+                "success": True,
+                "questions_per_category": questions_per_category,
+                "questions_per_difficulty": questions_per_difficulty,
+                "total_questions": total_questions,
+            }
+        )
+
     """
   @TODO: 
   Create an endpoint to POST a new question, 
@@ -162,6 +441,7 @@ def create_app(test_config=None):
       """
 
     @app.route("/questions", methods=["POST"])
+    @admission_control.limited
     def add_question():
         """
       This API is used to add question
@@ -174,19 +454,7 @@ def create_app(test_config=None):
         search_term = body.get("searchTerm", None)
         # check search term
         if search_term is not None:  # None is explit, to do search in case empty string
-            # Remove spaces from the begining and end
-            search_term = search_term.strip()
-            selection = Question.query.filter(
-                Question.question.ilike("%{}%".format(search_term))
-            )
-            current_questions = pagination_questions(request, selection)
-            return jsonify(
-                {
-                    "success": True,
-                    "questions": current_questions,
-                    "total_questions": len(selection.all()),
-                }
-            )
+            return search_questions(search_term)
         else:
             # Validate that I have all the values
             if not question or not answer or not difficulty or not category:
@@ -195,23 +463,118 @@ def create_app(test_config=None):
                 question = Question(
                     question=question,
                     answer=answer,
-                    difficulty=difficulty,
-                    category=category,
+                    difficulty=int(difficulty),
+                    category=int(category),
                 )
                 question.insert()
-                selection = Question.query.order_by(Question.id).all()
-                current_questions = pagination_questions(request, selection)
-                return jsonify(
-                    {
-                        "success": True,
-                        "created": question.id,
-                        "questions": current_questions,
-                        "total_questions": len(selection),
-                    }
-                )
+                return write_response(request, {"created": question.id})
             except:
                 abort(422)
 
+    @read_only
+    def search_questions(search_term):
+        """
+      This function is used to search the questions, the search branch of add_question
+      """
+        # Remove spaces from the begining and end
+        search_term = search_term.strip()
+        page = request.args.get("page", 1, type=int)
+        if question_snapshot.enabled:
+            current_questions, total_questions = question_snapshot.get().search(
+                search_term, page, QUESTIONS_PER_PAGE
+            )
+        else:
+            current_questions, total_questions = question_search.search(
+                search_term, page, QUESTIONS_PER_PAGE
+            )
+        return response_encoder.jsonify(
+            {
+                "success": True,
+                "questions": current_questions,
+                "total_questions": total_questions,
+            }
+        )
+
+    @app.route("/questions/batch-get", methods=["POST"])
+    @admission_control.limited
+    @read_only
+    def get_questions_in_batch():
+        """
+      This API is used to get many questions by id in one request, the questions come
+      in the order of the ids and the ids of no question are returned as missing
+      """
+        question_ids = get_batch_ids(request.get_json())
+        if question_ids is None:
+            abort(400)
+        questions = questions_by_id(question_ids)
+        found = {question["id"] for question in questions}
+        return response_encoder.jsonify(
+            {
+                "success": True,
+                "questions": questions,
+                "missing": [i for i in question_ids if i not in found],
+            }
+        )
+
+    @app.route("/questions/batch-delete", methods=["POST"])
+    @admission_control.limited
+    def delete_questions_in_batch():
+        """
+      This API is used to delete many questions in one transaction, the response is
+      minimal unless the client asks for `return=representation`
+      """
+        question_ids = get_batch_ids(request.get_json())
+        if question_ids is None:
+            abort(422)
+        deleted = Question.delete_many(question_ids)
+        return write_response(
+            request,
+            {"deleted": [question["id"] for question in deleted]},
+            default="minimal",
+        )
+
+    @app.route("/questions/import", methods=["POST"])
+    @admission_control.limited
+    def import_questions_in_bulk():
+        """
+      This API is used to import many questions, the body is streamed as NDJSON
+      (one question object per line) or as CSV when the content type is text/csv
+      """
+        format = "csv" if request.mimetype == "text/csv" else "ndjson"
+        stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+        try:
+            result = import_questions(stream, format)
+        except ImportFailed as error:
+            # The batches before the failure are committed, the client resumes at line
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": 422,
+                        "message": "unprocessable",
+                        "imported": error.imported,
+                        "line": error.line,
+                    }
+                ),
+                422,
+            )
+        result["success"] = True
+        return jsonify(result)
+
+    @app.route("/questions/export")
+    @admission_control.limited
+    def export_questions_in_bulk():
+        """
+      This API is used to stream all the questions as NDJSON, or CSV with ?format=csv
+      """
+        format = request.args.get("format", "ndjson")
+        if format not in ("ndjson", "csv"):
+            abort(400)
+        mimetype = "text/csv" if format == "csv" else "application/x-ndjson"
+        return Response(
+            stream_with_context(export_questions(format)), mimetype=mimetype
+        )
+
     """
   @TODO: 
   Create a POST endpoint to get questions based on a search term. 
@@ -233,21 +596,31 @@ def create_app(test_config=None):
   """
 
     @app.route("/categories/<int:category_id>/questions")
+    @admission_control.limited
+    @read_only
+    @conditional("questions", "categories")
+    @response_cache.cached("questions", "categories")
+    @admission_control.coalesced("questions", "categories")
     def get_questions_per_category(category_id):
         # validate the id is of valid category as it is get request it is exposed in url
-        category = Category.query.filter(Category.id == category_id).one_or_none()
+        category_type = category_registry.get(category_id)
         # If there is no category, we have to return bad request
-        if not category:
+        if not category_type:
             abort(400)
 
-        selection = Question.query.filter(Question.category == category_id).all()
-        current_questions = pagination_questions(request, selection)
-        return jsonify(
+        if question_snapshot.enabled:
+            current_questions = pagination_snapshot(request, category_id)
+            total_questions = question_snapshot.get().count(category_id)
+        else:
+            selection = Question.query.filter(Question.category == category_id)
+            current_questions = pagination_questions(request, selection)
+            total_questions = count_questions(selection)
+        return response_encoder.jsonify(
             {
                 "success": True,
                 "questions": current_questions,
-                "total_questions": len(selection),
-                "current_category": category.type,
+                "total_questions": total_questions,
+                "current_category": category_type,
             }
         )
 
@@ -264,35 +637,236 @@ def create_app(test_config=None):
   """
 
     @app.route("/quizzes", methods=["POST"])
+    @admission_control.limited
+    @read_only
     def get_quiz():
         body = request.get_json()
         quiz_category = body.get("quiz_category")
         previous_questions = body.get("previous_questions")
-        category_id = quiz_category.get("id", None)
+        if question_snapshot.enabled:
+            return get_quiz_from_snapshot(body, quiz_category, previous_questions)
+
+        # The next questions at once, when the client asks for a count
+        if "count" in body:
+            category = get_quiz_category(quiz_category)
+            count = get_batch_size(body["count"])
+            if count is None:
+                abort(400)
+            questions, remaining_questions = get_next_questions(
+                category, get_previous_questions(previous_questions), count
+            )
+            return response_encoder.jsonify(
+                {
+                    "success": True,
+                    "questions": quiz_questions(questions),
+                    "remaining_questions": remaining_questions,
+                }
+            )
+
+        question = get_next_question(
+            get_quiz_category(quiz_category), get_previous_questions(previous_questions)
+        )
+        # The user has got all the questions
+        if question is None:
+            return jsonify({"success": True})
+
+        return jsonify({"success": True, "question": quiz_questions([question])[0]})
 
-        if category_id == None:
+    @app.route("/quizzes/generate", methods=["POST"])
+    @admission_control.limited
+    @read_only
+    def generate_quiz():
+        """
+      This API is used to build a whole quiz from a spec of the number of questions,
+      the weights of the categories and of the difficulties, and a seed
+      """
+        body = request.get_json()
+        try:
+            count, category_weights, difficulties, seed = quiz_generator.parse_spec(
+                body, category_registry.all()
+            )
+        except InvalidQuizSpec:
             abort(400)
-        elif category_id != 0:
-            # Then it is one of the categories
-            category = Category.query.filter(
-                Category.type == quiz_category.get("type")
-            ).one_or_none()
+        question_ids = quiz_generator.generate(
+            count, category_weights, difficulties, seed
+        )
+        questions = questions_by_id(question_ids)
+        return response_encoder.jsonify(
+            {
+                "success": True,
+                "questions": quiz_questions(questions),
+                "total_questions": len(questions),
+                "seed": seed,
+            }
+        )
 
-            if not category:
-                abort(400)
-            questions = Question.query.filter(Question.category == category.id).all()
+    @app.route("/quizzes/answer", methods=["POST"])
+    @admission_control.limited
+    @read_only
+    def check_quiz_answer():
+        """
+      This API is used to check the answer of a player to a quiz question, against the
+      normalized answer of the question
+      """
+        body = request.get_json() or {}
+        submitted = body.get("answer", None)
+        try:
+            question_id = int(body.get("question_id", None))
+        except (TypeError, ValueError):
+            abort(400)
+        if not isinstance(submitted, str):
+            abort(400)
+        result = answer_checker.check(question_id, submitted)
+        if result is None:
+            abort(404)
+        correct, answer = result
+        return jsonify(
+            {
+                "success": True,
+                "question_id": question_id,
+                "correct": correct,
+                "answer": answer,
+            }
+        )
+
+    @app.route("/quizzes/sessions", methods=["POST"])
+    @admission_control.limited
+    @read_only
+    def start_quiz_session():
+        """
+      This API is used to start a quiz session, the questions of the quiz category are
+      shuffled once and kept on the server so the client does not send the previous questions
+      """
+        body = request.get_json()
+        quiz_category = body.get("quiz_category") or {}
+        if question_snapshot.enabled:
+            category = get_quiz_category(quiz_category)
+            session_id, total_questions = quiz_sessions.start_ids(
+                question_snapshot.get().category_ids(category)
+            )
         else:
-            # then All is selected
-            questions = Question.query.all()
+            selection = get_quiz_selection(quiz_category)
+            session_id, total_questions = quiz_sessions.start(selection)
+        return jsonify(
+            {
+                "success": True,
+                "session_id": session_id,
+                "total_questions": total_questions,
+            }
+        )
 
+    @app.route("/quizzes/sessions/<session_id>/next", methods=["POST"])
+    @admission_control.limited
+    @read_only
+    def get_quiz_session_question(session_id):
+        """
+      This API is used to get the next question of a quiz session, or the next
+      questions with ?count=
+      """
+        # The next questions at once, when the client asks for a count
+        if "count" in request.args:
+            count = get_batch_size(request.args["count"])
+            if count is None:
+                abort(400)
+            result = quiz_sessions.take(session_id, count)
+            if result is None:
+                abort(404)
+            questions, remaining_questions = result
+            return response_encoder.jsonify(
+                {
+                    "success": True,
+                    "questions": quiz_questions(questions),
+                    "remaining_questions": remaining_questions,
+                }
+            )
+
+        result = quiz_sessions.next(session_id)
+        if result is None:
+            abort(404)
+        question, remaining_questions = result
         # The user has got all the questions
-        if len(questions) == len(previous_questions):
-            return jsonify({"success": True})
+        if question is None:
+            return jsonify({"success": True, "remaining_questions": 0})
+        return jsonify(
+            {
+                "success": True,
+                "question": quiz_questions([question])[0],
+                "remaining_questions": remaining_questions,
+            }
+        )
 
-        # I used to shuffle the array everytime to get a random generations
-        shuffle(questions)
-        question = get_next_question(questions, previous_questions)
-        return jsonify({"success": True, "question": question.format()})
+    @app.route("/quizzes/sessions/<session_id>", methods=["DELETE"])
+    def end_quiz_session(session_id):
+        """
+      This API is used to end a quiz session before its last question
+      """
+        quiz_sessions.end(session_id)
+        return jsonify({"success": True, "deleted": session_id})
+
+    @app.route("/players", methods=["POST"])
+    def add_player():
+        """
+      This API is used to add a player, the names are unique
+      """
+        name = (request.get_json() or {}).get("name", None)
+        if not isinstance(name, str) or not name.strip():
+            abort(422)
+        try:
+            player = Player(name=name.strip())
+            player.insert()
+        except:
+            abort(422)
+        scores.add_player(player)
+        return jsonify({"success": True, "player": player.format()})
+
+    @app.route("/scores", methods=["POST"])
+    def add_score():
+        """
+      This API is used to add the points a player got for a question of a category,
+      the points are buffered and written to the database in batches
+      """
+        body = request.get_json() or {}
+        try:
+            player_id = int(body.get("player_id", None))
+            category = int(body.get("category", None))
+            points = int(body.get("points", None))
+        except (TypeError, ValueError):
+            abort(422)
+        if points < 0 or not category_registry.get(category):
+            abort(422)
+        if scores.player_name(player_id) is None:
+            abort(404)
+        scores.record(player_id, category, points)
+        return jsonify({"success": True})
+
+    @app.route("/leaderboard")
+    @admission_control.limited
+    @read_only
+    def get_leaderboard():
+        """
+      This API is used to get the players with the most points, in a category with
+      ?category=<id> or in all the categories
+      """
+        category = request.args.get("category", ALL_CATEGORIES, type=int)
+        limit = request.args.get("limit", 10, type=int)
+        if category != ALL_CATEGORIES and not category_registry.get(category):
+            abort(400)
+        if not 1 <= limit <= scores.size:
+            abort(400)
+        return response_encoder.jsonify(
+            {
+                "success": True,
+                "category": category,
+                "leaderboard": scores.leaderboard(category, limit),
+            }
+        )
+
+    @app.route("/health")
+    def health():
+        """
+      This API is used to check the worker and the state of its database connection pool
+      """
+        return jsonify({"success": True, "pool": get_pool_stats()})
 
     """
   @TODO: 
@@ -328,6 +902,14 @@ def create_app(test_config=None):
             405,
         )
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return (
+            jsonify({"success": False, "error": 503, "message": "service unavailable"}),
+            503,
+            {"Retry-After": str(admission_control.retry_after)},
+        )
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return (
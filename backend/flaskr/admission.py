@@ -0,0 +1,205 @@
+import time
+from functools import wraps
+from threading import BoundedSemaphore, Event, Lock
+
+from flask import abort, current_app, make_response, request
+
+from .http_cache import content_etag
+from .instrumentation import instrumentation
+
+
+class Call:
+    """
+    A view running for the requests of a single-flight key, the requests arriving
+    meanwhile wait for its response
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.response = None
+
+
+class AdmissionControl:
+    """
+    Bounds the requests of the database bound views of each worker. At most
+    `max_concurrency` of them run at once, up to `queue_size` more wait at most
+    `queue_timeout` seconds for their turn, and the others are answered at once with
+    a 503 and a Retry-After of `retry_after` seconds, so a burst is shed instead of
+    queueing on the connection pool. Disabled while `max_concurrency` is 0.
+
+    Identical concurrent GET requests of the views decorated with `coalesced` run the
+    view once, the others wait at most `queue_timeout` seconds for a copy of its
+    response (single-flight)
+    """
+
+    def __init__(self):
+        self.max_concurrency = 0
+        self.queue_size = 50
+        self.queue_timeout = 1.0
+        self.retry_after = 1
+        self.slots = None
+        self._lock = Lock()
+        self._calls = {}
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+        self.queue_time = 0.0
+        self.coalesced_requests = 0
+
+    def init_app(self, app):
+        self.max_concurrency = app.config.get("ADMISSION_MAX_CONCURRENCY", 0)
+        self.queue_size = app.config.get("ADMISSION_QUEUE_SIZE", 50)
+        self.queue_timeout = app.config.get("ADMISSION_QUEUE_TIMEOUT", 1.0)
+        self.retry_after = app.config.get("ADMISSION_RETRY_AFTER", 1)
+        self.slots = None
+        if self.max_concurrency:
+            self.slots = BoundedSemaphore(self.max_concurrency)
+
+    def acquire(self, slots):
+        """
+        Waits for a slot, returns False when the request is shed
+        """
+        if slots.acquire(blocking=False):
+            with self._lock:
+                self.admitted += 1
+                self.in_flight += 1
+            return True
+        with self._lock:
+            if self.waiting >= self.queue_size:
+                self.rejected["queue_full"] += 1
+                return False
+            self.waiting += 1
+        started = time.perf_counter()
+        acquired = slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self.waiting -= 1
+            self.queue_time += time.perf_counter() - started
+            if not acquired:
+                self.rejected["timeout"] += 1
+                return False
+            self.admitted += 1
+            self.in_flight += 1
+        return True
+
+    def release(self, slots):
+        with self._lock:
+            self.in_flight -= 1
+        slots.release()
+
+    def limited(self, view):
+        """
+        Decorator bounding the concurrent requests of a view, the slot of a streamed
+        response is kept until its body is sent
+        """
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            slots = self.slots
+            if slots is None:
+                return view(*args, **kwargs)
+            if not self.acquire(slots):
+                abort(503)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                self.release(slots)
+                raise
+            if response.is_streamed:
+                response.call_on_close(lambda: self.release(slots))
+            else:
+                self.release(slots)
+            return response
+
+        return wrapper
+
+    def coalesced(self, *revisions):
+        """
+        Decorator running a GET view once for the identical requests arriving while
+        it runs, keyed by the path, the query arguments and the given content revisions
+        (see ContentRevision), so a request reading after a write never gets the
+        response of a read started before it
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = "{}#{}".format(request.full_path, content_etag(revisions))
+                with self._lock:
+                    call = self._calls.get(key)
+                    leader = call is None
+                    if leader:
+                        call = self._calls[key] = Call()
+                    else:
+                        self.coalesced_requests += 1
+                if not leader:
+                    if not call.done.wait(self.queue_timeout):
+                        with self._lock:
+                            self.rejected["timeout"] += 1
+                        abort(503)
+                    # The view failed for the first request, this one runs it again
+                    if call.response is None:
+                        return view(*args, **kwargs)
+                    status, headers, body = call.response
+                    return current_app.response_class(
+                        body, status=status, headers=headers
+                    )
+                try:
+                    response = make_response(view(*args, **kwargs))
+                    call.response = (
+                        response.status_code,
+                        list(response.headers),
+                        response.get_data(),
+                    )
+                    return response
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+
+            return wrapper
+
+        return decorator
+
+    def render(self):
+        """
+        Returns the Prometheus text lines of the admission control of this worker
+        """
+        with self._lock:
+            lines = [
+                "# HELP trivia_admission_in_flight Requests running.",
+                "# TYPE trivia_admission_in_flight gauge",
+                "trivia_admission_in_flight {}".format(self.in_flight),
+                "# HELP trivia_admission_waiting Requests waiting for their turn.",
+                "# TYPE trivia_admission_waiting gauge",
+                "trivia_admission_waiting {}".format(self.waiting),
+                "# HELP trivia_admission_admitted_total Requests admitted.",
+                "# TYPE trivia_admission_admitted_total counter",
+                "trivia_admission_admitted_total {}".format(self.admitted),
+                "# HELP trivia_admission_rejected_total Requests answered with 503.",
+                "# TYPE trivia_admission_rejected_total counter",
+            ]
+            for reason, count in sorted(self.rejected.items()):
+                lines.append(
+                    'trivia_admission_rejected_total{{reason="{}"}} {}'.format(
+                        reason, count
+                    )
+                )
+            lines.extend(
+                [
+                    "# HELP trivia_admission_queue_seconds_total Time spent waiting.",
+                    "# TYPE trivia_admission_queue_seconds_total counter",
+                    "trivia_admission_queue_seconds_total {}".format(self.queue_time),
+                    "# HELP trivia_coalesced_requests_total Requests answered with "
+                    "the response of an identical request.",
+                    "# TYPE trivia_coalesced_requests_total counter",
+                    "trivia_coalesced_requests_total {}".format(
+                        self.coalesced_requests
+                    ),
+                ]
+            )
+        return lines
+
+
+admission_control = AdmissionControl()
+instrumentation.add_exporter(admission_control.render)
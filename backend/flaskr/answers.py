@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from threading import Lock
+
+from models import db, normalize_answer, Question, question_listeners
+
+
+def within_edits(first, second, max_edits):
+    """
+    This function is used to know if the Levenshtein distance between two strings is
+    at most `max_edits`, only the band of the matrix around its diagonal is computed
+    """
+    if abs(len(first) - len(second)) > max_edits:
+        return False
+    if max_edits == 0:
+        return first == second
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i] + [max_edits + 1] * len(second)
+        low = max(1, i - max_edits)
+        high = min(len(second), i + max_edits)
+        for j in range(low, high + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (first_char != second[j - 1]),
+            )
+        if min(current[low - 1 : high + 1]) > max_edits:
+            return False
+        previous = current
+    return previous[len(second)] <= max_edits
+
+
+class AnswerChecker:
+    """
+    Checks the answers submitted to the quizzes against the normalized answer stored
+    with each question. The (answer, normalized answer) of the questions are kept in
+    memory, at most `max_entries` of them, loaded by primary key on first use and
+    dropped by the question listeners when a question changes.
+
+    With `max_edits` above 0 an answer is also right when it is at most that many
+    edits away from the expected one, limited to a quarter of the expected length so
+    short answers still have to be exact
+    """
+
+    def __init__(self, max_edits=0, max_entries=100000):
+        self.max_edits = max_edits
+        self.max_entries = max_entries
+        self._answers = OrderedDict()
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.max_edits = app.config.get("ANSWER_MAX_EDITS", self.max_edits)
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._answers.clear()
+
+    def expected(self, question_id):
+        """
+        Returns the (answer, normalized answer) of the question, None if there is no
+        such question
+        """
+        with self._lock:
+            entry = self._answers.get(question_id)
+            if entry is not None:
+                self._answers.move_to_end(question_id)
+                return entry
+        row = (
+            db.session.query(Question.answer, Question.normalized_answer)
+            .filter(Question.id == question_id)
+            .one_or_none()
+        )
+        if row is None:
+            return None
+        answer, normalized = row
+        # Questions written before the column existed have no normalized answer
+        if normalized is None:
+            normalized = normalize_answer(answer)
+        entry = (answer, normalized)
+        with self._lock:
+            self._answers[question_id] = entry
+            while len(self._answers) > self.max_entries:
+                self._answers.popitem(last=False)
+        return entry
+
+    def check(self, question_id, submitted):
+        """
+        Returns whether the submitted answer is right and the expected answer, None if
+        there is no such question
+        """
+        entry = self.expected(question_id)
+        if entry is None:
+            return None
+        answer, normalized = entry
+        submitted = normalize_answer(submitted)
+        if not submitted or not normalized:
+            return False, answer
+        max_edits = min(self.max_edits, len(normalized) // 4)
+        return within_edits(submitted, normalized, max_edits), answer
+
+    def on_question_change(self, action, question):
+        if action == "reload":
+            self.invalidate()
+            return
+        with self._lock:
+            self._answers.pop(question["id"], None)
+
+
+answer_checker = AnswerChecker()
+question_listeners.append(answer_checker.on_question_change)
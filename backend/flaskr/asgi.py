@@ -0,0 +1,429 @@
+"""
+Async ASGI entry point of the trivia API, serving the same routes and JSON responses
+as the Flask app of create_app on an async database driver (asyncpg on PostgreSQL,
+aiosqlite on SQLite) with a connection pool, so one process can wait on many database
+round-trips at once. It needs the packages of requirements-asgi.txt:
+
+    uvicorn --factory flaskr.asgi:create_asgi_app --workers 4
+"""
+import contextlib
+import os
+import random
+import time
+
+from databases import Database
+from sqlalchemy import func, select
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from models import (
+    default_database_path,
+    normalize_answer,
+    Category,
+    ContentRevision,
+    Question,
+    QuestionChange,
+    QuestionStat,
+)
+from .quiz_generator import sample_unseen
+from .search import PostgresSearchBackend, SQLSearchBackend
+
+QUESTIONS_PER_PAGE = 10
+CATEGORY_CACHE_TTL = 300
+QUESTION_CHANGES_KEPT = 10000
+
+questions = Question.__table__
+categories = Category.__table__
+content_revisions = ContentRevision.__table__
+question_changes = QuestionChange.__table__
+question_stats = QuestionStat.__table__
+
+# Upserts of PostgreSQL and SQLite, two first writes can not both insert the row
+BUMP_REVISION = (
+    "INSERT INTO content_revisions (name, value) VALUES (:name, 1) "
+    "ON CONFLICT (name) DO UPDATE SET value = content_revisions.value + 1"
+)
+COUNT_QUESTION = (
+    "INSERT INTO question_stats (category, difficulty, questions) "
+    "VALUES (:category, :difficulty, :questions) "
+    "ON CONFLICT (category, difficulty) DO UPDATE "
+    "SET questions = question_stats.questions + excluded.questions"
+)
+
+ERROR_MESSAGES = {
+    400: "bad request",
+    404: "resource not found",
+    405: "not allowed",
+    422: "unprocessable",
+    500: "internal server error",
+}
+
+
+def format_question(row):
+    return {
+        "id": row["id"],
+        "question": row["question"],
+        "answer": row["answer"],
+        "category": row["category"],
+        "difficulty": row["difficulty"],
+    }
+
+
+def pool_options(database_url):
+    """
+    This function is used to size the connection pool from the same environment
+    variables as the engine of the Flask app
+    """
+    if not database_url.startswith("postgres"):
+        return {}
+    options = {}
+    if "DATABASE_POOL_SIZE" in os.environ:
+        options["min_size"] = int(os.environ["DATABASE_POOL_SIZE"])
+        options["max_size"] = options["min_size"] + int(
+            os.environ.get("DATABASE_MAX_OVERFLOW", 0)
+        )
+    return options
+
+
+def query_int(request, name, default=None):
+    """
+    This function is used to read an integer query argument, the default when it is
+    missing or not an integer, as request.args.get(name, default, type=int) in Flask
+    """
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def previous_question_ids(previous_questions):
+    """
+    This function is used to read the previous questions of a quiz as
+    get_previous_questions does, a bad request unless they are a list of integers
+    """
+    if previous_questions is None:
+        return set()
+    if not isinstance(previous_questions, list):
+        raise HTTPException(status_code=400)
+    try:
+        return {int(question_id) for question_id in previous_questions}
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400)
+
+
+def create_asgi_app(database_url=None):
+    database_url = database_url or os.environ.get("DATABASE_URL", default_database_path)
+    database = Database(database_url, **pool_options(database_url))
+    if database_url.startswith("postgres"):
+        search_backend = PostgresSearchBackend()
+    else:
+        search_backend = SQLSearchBackend()
+    category_cache = {"categories": None, "expires_at": 0}
+    question_ids = {"revision": None, "all": [], "categories": {}, "by_category": {}}
+
+    async def get_all_categories():
+        """
+        This function is used to get the {id: type} categories, cached for a few minutes
+        """
+        if category_cache["expires_at"] <= time.monotonic():
+            rows = await database.fetch_all(
+                select([categories]).order_by(categories.c.id)
+            )
+            category_cache["categories"] = {row["id"]: row["type"] for row in rows}
+            category_cache["expires_at"] = time.monotonic() + CATEGORY_CACHE_TTL
+        return category_cache["categories"]
+
+    async def paginate_questions(request, condition=None):
+        """
+        This function is used to fetch a page of questions, as pagination_questions
+        """
+        page = query_int(request, "page", 1)
+        after_id = query_int(request, "after_id")
+        query = select([questions]).order_by(questions.c.id).limit(QUESTIONS_PER_PAGE)
+        if condition is not None:
+            query = query.where(condition)
+        if after_id is not None:
+            query = query.where(questions.c.id > after_id)
+        elif page < 1:
+            return []
+        else:
+            query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
+        return [format_question(row) for row in await database.fetch_all(query)]
+
+    async def count_questions(condition=None):
+        query = select([func.count(questions.c.id)])
+        if condition is not None:
+            query = query.where(condition)
+        return await database.fetch_val(query)
+
+    async def bump_revision(name):
+        await database.execute(BUMP_REVISION, {"name": name})
+
+    async def count_question(category, difficulty, questions):
+        # as QuestionStat.add, a question without category or difficulty under 0
+        await database.execute(
+            COUNT_QUESTION,
+            {
+                "category": category or 0,
+                "difficulty": difficulty or 0,
+                "questions": questions,
+            },
+        )
+
+    async def get_question_ids():
+        """
+        This function is used to get the question ids held in memory, all of them and
+        by category, loaded again when the revision of the questions moved, so a quiz
+        is drawn without counting nor skipping the questions of the database
+        """
+        revision = await database.fetch_val(
+            select([content_revisions.c.value]).where(
+                content_revisions.c.name == "questions"
+            )
+        )
+        if question_ids["revision"] != (revision or 0):
+            # Read after the revision, a write in between is loaded again later
+            rows = await database.fetch_all(
+                select([questions.c.id, questions.c.category]).order_by(questions.c.id)
+            )
+            question_ids["all"] = [row["id"] for row in rows]
+            question_ids["categories"] = {row["id"]: row["category"] for row in rows}
+            question_ids["by_category"] = {}
+            for row in rows:
+                question_ids["by_category"].setdefault(row["category"], []).append(
+                    row["id"]
+                )
+            question_ids["revision"] = revision or 0
+        return question_ids
+
+    async def write_response(request, result):
+        result["success"] = True
+        result["total_questions"] = await count_questions()
+        if request.query_params.get("return") == "minimal" or "return=minimal" in (
+            request.headers.get("Prefer", "")
+        ):
+            return JSONResponse(
+                result, headers={"Preference-Applied": "return=minimal"}
+            )
+        result["questions"] = await paginate_questions(request)
+        return JSONResponse(result)
+
+    async def get_categories(request):
+        all_categories = await get_all_categories()
+        if len(all_categories) == 0:
+            raise HTTPException(status_code=404)
+        return JSONResponse({"success": True, "categories": all_categories})
+
+    async def get_questions(request):
+        current_questions = await paginate_questions(request)
+        if len(current_questions) == 0:
+            raise HTTPException(status_code=404)
+        all_categories = await get_all_categories()
+        if len(all_categories) == 0:
+            raise HTTPException(status_code=404)
+        return JSONResponse(
+            {
+                "success": True,
+                "questions": current_questions,
+                "total_questions": await count_questions(),
+                "current_category": all_categories[1],
+                "categories": all_categories,
+            }
+        )
+
+    async def delete_question(request):
+        question_id = request.path_params["question_id"]
+        async with database.transaction():
+            row = await database.fetch_one(
+                select(
+                    [questions.c.id, questions.c.category, questions.c.difficulty]
+                ).where(questions.c.id == question_id)
+            )
+            # as the Flask app, a question that does not exist is unprocessable
+            if row is None:
+                raise HTTPException(status_code=422)
+            deleted = row["id"]
+            await database.execute(questions.delete().where(questions.c.id == deleted))
+            await bump_revision("questions")
+            await database.execute(
+                question_changes.insert().values(question_id=deleted)
+            )
+            await database.execute(QuestionChange.trim(QUESTION_CHANGES_KEPT))
+            await count_question(row["category"], row["difficulty"], -1)
+        return await write_response(request, {"deleted": deleted})
+
+    async def add_question(request):
+        body = await read_json(request)
+        search_term = body.get("searchTerm", None)
+        if search_term is not None:
+            search_term = search_term.strip()
+            condition = search_backend.matches(search_term)
+            page = query_int(request, "page", 1)
+            rows = []
+            if page >= 1:
+                # the page and the total together, as the search of the Flask app
+                rows = await database.fetch_all(
+                    select(
+                        [questions, func.count(questions.c.id).over().label("total")]
+                    )
+                    .where(condition)
+                    .order_by(*search_backend.order_by(search_term))
+                    .offset((page - 1) * QUESTIONS_PER_PAGE)
+                    .limit(QUESTIONS_PER_PAGE)
+                )
+            if rows:
+                total_questions = rows[0]["total"]
+            else:
+                total_questions = await count_questions(condition)
+            return JSONResponse(
+                {
+                    "success": True,
+                    "questions": [format_question(row) for row in rows],
+                    "total_questions": total_questions,
+                }
+            )
+        values = {
+            field: body.get(field, None)
+            for field in ("question", "answer", "difficulty", "category")
+        }
+        if not all(values.values()):
+            raise HTTPException(status_code=422)
+        try:
+            values["difficulty"] = int(values["difficulty"])
+            values["category"] = int(values["category"])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=422)
+        values["normalized_answer"] = normalize_answer(values["answer"])
+        query = questions.insert().values(**values)
+        if database.url.dialect == "postgresql":
+            query = query.returning(questions.c.id)
+        async with database.transaction():
+            created = await database.execute(query)
+            await bump_revision("questions")
+            await database.execute(
+                question_changes.insert().values(question_id=created)
+            )
+            await database.execute(QuestionChange.trim(QUESTION_CHANGES_KEPT))
+            await count_question(values["category"], values["difficulty"], 1)
+        return await write_response(request, {"created": created})
+
+    async def get_questions_per_category(request):
+        category_id = request.path_params["category_id"]
+        category_type = (await get_all_categories()).get(category_id)
+        if not category_type:
+            raise HTTPException(status_code=400)
+        condition = questions.c.category == category_id
+        return JSONResponse(
+            {
+                "success": True,
+                "questions": await paginate_questions(request, condition),
+                "total_questions": await count_questions(condition),
+                "current_category": category_type,
+            }
+        )
+
+    async def get_quiz(request):
+        body = await read_json(request)
+        quiz_category = body.get("quiz_category") or {}
+        category_id = quiz_category.get("id", None)
+        category = None
+        if category_id == None:
+            raise HTTPException(status_code=400)
+        elif category_id != 0:
+            all_categories = await get_all_categories()
+            category = next(
+                (
+                    category
+                    for category, category_type in all_categories.items()
+                    if category_type == quiz_category.get("type")
+                ),
+                None,
+            )
+            if not category:
+                raise HTTPException(status_code=400)
+        previous_questions = previous_question_ids(body.get("previous_questions"))
+        # as get_next_question, the id is drawn from the ids held in memory
+        row = None
+        while row is None:
+            ids = await get_question_ids()
+            if category is None:
+                pool = ids["all"]
+            else:
+                pool = ids["by_category"].get(category, [])
+            available = len(pool) - sum(
+                1
+                for question_id in previous_questions
+                if question_id in ids["categories"]
+                and category in (None, ids["categories"][question_id])
+            )
+            # The user has got all the questions
+            if available == 0:
+                return JSONResponse({"success": True})
+            question_id = sample_unseen(
+                random, [pool], previous_questions, available, 1
+            )[0]
+            row = await database.fetch_one(
+                select([questions]).where(questions.c.id == question_id)
+            )
+            if row is None:
+                # deleted since the ids were loaded, they are loaded again
+                question_ids["revision"] = None
+        return JSONResponse({"success": True, "question": format_question(row)})
+
+    async def http_error(request, exc):
+        status_code = exc.status_code if exc.status_code in ERROR_MESSAGES else 500
+        return JSONResponse(
+            {
+                "success": False,
+                "error": status_code,
+                "message": ERROR_MESSAGES[status_code],
+            },
+            status_code=status_code,
+        )
+
+    async def server_error(request, exc):
+        return await http_error(request, HTTPException(status_code=500))
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        await database.connect()
+        try:
+            yield
+        finally:
+            await database.disconnect()
+
+    routes = [
+        Route("/categories", get_categories),
+        Route("/questions", get_questions),
+        Route("/questions", add_question, methods=["POST"]),
+        Route("/questions/{question_id:int}", delete_question, methods=["DELETE"]),
+        Route("/categories/{category_id:int}/questions", get_questions_per_category),
+        Route("/quizzes", get_quiz, methods=["POST"]),
+    ]
+    middleware = [
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_headers=["Content-Type", "Authorization"],
+            allow_methods=["GET", "PUT", "POST", "DELETE", "OPTIONS"],
+        )
+    ]
+    asgi_app = Starlette(
+        routes=routes,
+        middleware=middleware,
+        exception_handlers={HTTPException: http_error, 500: server_error},
+        lifespan=lifespan,
+    )
+    asgi_app.state.database = database
+    return asgi_app
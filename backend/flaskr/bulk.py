@@ -0,0 +1,241 @@
+import csv
+import io
+import json
+
+import click
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import bindparam
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import db, normalize_answer, Question, QuestionStat
+from .categories import category_registry
+
+IMPORT_BATCH_SIZE = 1000
+# Stop reporting the invalid rows after this many, the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+EXPORT_FIELDS = ["id", "question", "answer", "category", "difficulty"]
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+class ImportFailed(Exception):
+    """
+    Raised when an import stops on a stream or database error, the `imported` rows of
+    the batches before it are committed and the rows from `line` on are not
+    """
+
+    def __init__(self, message, imported, line):
+        super().__init__(message)
+        self.imported = imported
+        self.line = line
+
+
+def read_rows(stream, format):
+    """
+    This function is used to read the rows of an NDJSON or CSV text stream one at a time,
+    yields (line number, row) and the row is None for a line that can not be parsed
+    """
+    if format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row
+
+
+def validate_row(row):
+    """
+    This function is used to validate an imported row and returns the question values
+    """
+    if not isinstance(row, dict):
+        raise InvalidRow("not a question object")
+    question = row.get("question")
+    answer = row.get("answer")
+    if not question or not answer:
+        raise InvalidRow("question and answer are required")
+    try:
+        category = int(row.get("category"))
+        difficulty = int(row.get("difficulty"))
+    except (TypeError, ValueError):
+        raise InvalidRow("category and difficulty must be integers")
+    if category_registry.get(category) is None:
+        raise InvalidRow("category {} does not exist".format(category))
+    return {
+        "question": question,
+        "answer": answer,
+        "category": category,
+        "difficulty": difficulty,
+    }
+
+
+def import_questions(stream, format="ndjson", batch_size=IMPORT_BATCH_SIZE):
+    """
+    This function is used to import the questions of a stream in batches, each batch is
+    inserted in its own transaction. Invalid rows are skipped and reported. A stream
+    that can not be read or a batch the database rejects rolls back the current batch
+    and raises ImportFailed
+    """
+    imported = 0
+    invalid = 0
+    errors = []
+    batch = []
+    line_number = 0
+    # the line of the first row of the batch, where a failed import stops
+    batch_line = None
+    try:
+        for line_number, row in read_rows(stream, format):
+            try:
+                values = validate_row(row)
+            except InvalidRow as error:
+                invalid += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"line": line_number, "message": str(error)})
+                continue
+            if not batch:
+                batch_line = line_number
+            batch.append(values)
+            if len(batch) == batch_size:
+                Question.bulk_insert(batch)
+                imported += len(batch)
+                batch = []
+        Question.bulk_insert(batch)
+        imported += len(batch)
+    # COPY runs on the DBAPI cursor, its errors are not wrapped by SQLAlchemy
+    except (
+        UnicodeDecodeError,
+        csv.Error,
+        SQLAlchemyError,
+        db.engine.dialect.dbapi.Error,
+    ) as error:
+        db.session.rollback()
+        line = batch_line if batch else line_number + 1
+        raise ImportFailed(str(error), imported, line)
+    return {"imported": imported, "invalid": invalid, "errors": errors}
+
+
+def export_questions(format="ndjson", batch_size=IMPORT_BATCH_SIZE):
+    """
+    This function is used to export all the questions as NDJSON or CSV text chunks,
+    the rows are streamed from a server-side cursor instead of being loaded at once
+    """
+    rows = (
+        db.session.query(*[getattr(Question, field) for field in EXPORT_FIELDS])
+        .order_by(Question.id)
+        .execution_options(stream_results=True)
+        .yield_per(batch_size)
+    )
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n"
+
+
+def normalize_answers(batch_size=IMPORT_BATCH_SIZE):
+    """
+    This function is used to fill the normalized answers of the questions written before
+    the column existed, one transaction per batch. Returns the number of questions filled
+    """
+    questions = Question.__table__
+    update = (
+        questions.update()
+        .where(questions.c.id == bindparam("question_id"))
+        .values(normalized_answer=bindparam("normalized"))
+    )
+    filled = 0
+    while True:
+        rows = (
+            db.session.query(Question.id, Question.answer)
+            .filter(Question.normalized_answer.is_(None))
+            .order_by(Question.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return filled
+        db.session.execute(
+            update,
+            [
+                # an answer that normalizes to nothing is stored as "" to be done
+                {
+                    "question_id": question_id,
+                    "normalized": normalize_answer(answer) or "",
+                }
+                for question_id, answer in rows
+            ],
+        )
+        db.session.commit()
+        filled += len(rows)
+
+
+questions_cli = AppGroup("questions", help="Bulk import and export of the questions.")
+
+
+@questions_cli.command("import")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", type=click.Choice(["ndjson", "csv"]), default="ndjson")
+@click.option("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+@with_appcontext
+def import_command(source, format, batch_size):
+    """Import the questions of an NDJSON or CSV file, - reads stdin."""
+    try:
+        result = import_questions(source, format, batch_size)
+    except ImportFailed as error:
+        raise click.ClickException(
+            "{} (imported {} questions, stopped at line {})".format(
+                error, error.imported, error.line
+            )
+        )
+    for error in result["errors"]:
+        click.echo("line {line}: {message}".format(**error), err=True)
+    click.echo(
+        "Imported {imported} questions, skipped {invalid} invalid rows.".format(
+            **result
+        )
+    )
+
+
+@questions_cli.command("export")
+@click.argument("target", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", type=click.Choice(["ndjson", "csv"]), default="ndjson")
+@with_appcontext
+def export_command(target, format):
+    """Export all the questions to an NDJSON or CSV file, stdout by default."""
+    for chunk in export_questions(format):
+        target.write(chunk)
+
+
+@questions_cli.command("normalize-answers")
+@click.option("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+@with_appcontext
+def normalize_answers_command(batch_size):
+    """Fill the normalized answers of the questions written before they existed."""
+    click.echo("Normalized {} answers.".format(normalize_answers(batch_size)))
+
+
+@questions_cli.command("rebuild-stats")
+@with_appcontext
+def rebuild_stats_command():
+    """Count the questions per category and difficulty again for GET /stats."""
+    click.echo(
+        "Counted {} category and difficulty pairs.".format(QuestionStat.rebuild())
+    )
@@ -0,0 +1,135 @@
+import json
+import time
+from threading import Lock
+
+from models import Category, ContentRevision, category_listeners
+
+
+class CategoryRegistry:
+    """
+    In-process cache of the categories as {id: type}, the categories are loaded once
+    from the database and kept for `ttl` seconds or until `invalidate` is called, as it
+    is by the category listeners after every write of the Category model.
+
+    The categories are kept with the revision of the categories they were loaded at (see
+    ContentRevision), and `sync` reloads them when a request reads a newer revision, so
+    the responses versioned by that revision are built from the categories written by
+    the other worker processes.
+
+    A shared `store` (any client with redis-like get/set/delete, e.g. redis.Redis) can
+    be given so the worker processes load the categories from each other instead of
+    the database
+    """
+
+    store_key = "trivia:categories"
+
+    def __init__(self, ttl=300, store=None):
+        self.ttl = ttl
+        self.store = store
+        self._cache = None
+        self._expires_at = 0
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get("CATEGORY_CACHE_TTL", self.ttl)
+        self.store = app.config.get("CATEGORY_CACHE_STORE", self.store)
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Drop the cached categories, the next lookup reloads them
+        """
+        with self._lock:
+            self._cache = None
+            self._expires_at = 0
+        if self.store is not None:
+            self.store.delete(self.store_key)
+
+    def _load(self, revision=None):
+        """
+        Returns the categories and their revision, from the store unless it has them at
+        a revision older than `revision`, the revision read by the request when it is
+        given
+        """
+        if self.store is not None:
+            cached = self.store.get(self.store_key)
+            if cached is not None:
+                cached = json.loads(cached)
+                if cached.get("revision", -1) >= (revision or 0):
+                    categories = {
+                        int(category_id): category_type
+                        for category_id, category_type in cached["categories"].items()
+                    }
+                    return categories, cached["revision"]
+        # read before the categories, a write in between is loaded again by sync
+        if revision is None:
+            revision = ContentRevision.get("categories")
+        categories = {
+            category.id: category.type
+            for category in Category.query.order_by(Category.id).all()
+        }
+        if self.store is not None:
+            self.store.set(
+                self.store_key,
+                json.dumps({"revision": revision, "categories": categories}),
+                ex=self.ttl,
+            )
+        return categories, revision
+
+    def _reload(self, revision=None):
+        categories, revision = self._load(revision)
+        ids_by_type = {
+            category_type: category_id
+            for category_id, category_type in categories.items()
+        }
+        self._cache = (categories, ids_by_type, revision)
+        self._expires_at = time.monotonic() + self.ttl
+
+    def _current(self):
+        """
+        Returns the cached (categories, ids by type, revision) tuple, reloading it when
+        it expired
+        """
+        cache = self._cache
+        if cache is not None and time.monotonic() < self._expires_at:
+            return cache
+        with self._lock:
+            # another thread may have reloaded it while we were waiting for the lock
+            if self._cache is None or time.monotonic() >= self._expires_at:
+                self._reload()
+            return self._cache
+
+    def sync(self, revision):
+        """
+        Reloads the categories when they were loaded at a revision of the categories
+        older than `revision`
+        """
+        cache = self._cache
+        if cache is not None and cache[2] >= revision:
+            return
+        with self._lock:
+            if self._cache is None or self._cache[2] < revision:
+                self._reload(revision)
+
+    def all(self):
+        """
+        Returns a dictionary of the categories in which the keys are the ids and the
+        values are the types
+        """
+        return self._current()[0]
+
+    def get(self, category_id):
+        """
+        Returns the type of the category, or None if there is no such category
+        """
+        return self._current()[0].get(category_id)
+
+    def get_id(self, category_type):
+        """
+        Returns the id of the category having this type, or None if there is no such category
+        """
+        return self._current()[1].get(category_type)
+
+
+category_registry = CategoryRegistry()
+category_listeners.append(category_registry.invalidate)
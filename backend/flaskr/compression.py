@@ -0,0 +1,140 @@
+import zlib
+
+from flask import request
+
+from .response_cache import response_cache
+
+try:
+    import brotli
+except ImportError:  # optional, br is not offered without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, zstd is not offered without it
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "text/csv",
+    "text/html",
+    "text/plain",
+)
+
+
+class BrotliCompressor:
+    """
+    The brotli streaming compressor with the compress/flush interface of zlib
+    """
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+def available_encodings():
+    """
+    This function is used to list the content encodings that can be used, best first,
+    each with a function returning a new streaming compressor
+    """
+    encodings = []
+    if brotli is not None:
+        encodings.append(("br", lambda: BrotliCompressor(5)))
+    if zstandard is not None:
+        encodings.append(("zstd", lambda: zstandard.ZstdCompressor(3).compressobj()))
+    # wbits 31 writes the gzip header and trailer, with no timestamp
+    encodings.append(("gzip", lambda: zlib.compressobj(6, zlib.DEFLATED, 31)))
+    return encodings
+
+
+def compress_stream(chunks, compressor):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class Compression:
+    """
+    Compresses the responses with the best content encoding the client accepts (br and
+    zstd when their packages are installed, gzip otherwise), for the text mimetypes and
+    bodies of at least `min_size` bytes. A streamed response is compressed as it is
+    sent. The compressed bodies of the responses of the response cache are kept in its
+    store next to them, so a hot page is compressed once per encoding rather than
+    on every request
+    """
+
+    def __init__(self, min_size=500):
+        self.min_size = min_size
+        self.encodings = available_encodings()
+
+    def init_app(self, app):
+        self.min_size = app.config.get("COMPRESSION_MIN_SIZE", self.min_size)
+        allowed = app.config.get("COMPRESSION_ENCODINGS")
+        self.encodings = [
+            (name, compressor)
+            for name, compressor in available_encodings()
+            if allowed is None or name in allowed
+        ]
+        app.after_request(self.after_request)
+
+    def choose(self):
+        """
+        Returns the name and compressor of the encoding to use for the request, None
+        when the client accepts none of them
+        """
+        names = [name for name, _ in self.encodings]
+        best = request.accept_encodings.best_match(names)
+        if best is None:
+            return None
+        return best, dict(self.encodings)[best]
+
+    def after_request(self, response):
+        if (
+            response.status_code != 200
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or not self.encodings
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        chosen = self.choose()
+        if chosen is None:
+            return response
+        name, compressor = chosen
+        if response.is_streamed:
+            response.response = compress_stream(response.response, compressor())
+            response.headers.pop("Content-Length", None)
+            response.headers["Content-Encoding"] = name
+            return response
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        cache_key = getattr(response, "cache_key", None)
+        compressed = None
+        if cache_key is not None:
+            compressed = response_cache.store.get("{}#{}".format(cache_key, name))
+        if compressed is None:
+            stream = compressor()
+            compressed = stream.compress(body) + stream.flush()
+            if cache_key is not None:
+                response_cache.store.set(
+                    "{}#{}".format(cache_key, name), compressed, ex=response_cache.ttl
+                )
+        if len(compressed) >= len(body):
+            return response
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = name
+        return response
+
+
+compression = Compression()
@@ -0,0 +1,56 @@
+from threading import Lock
+
+from sqlalchemy import func
+
+from models import db, Question, question_listeners
+
+
+class QuestionCounter:
+    """
+    Number of questions kept in memory with the revision of the questions it was counted
+    at (see ContentRevision), counted once with a COUNT and then adjusted by the question
+    listeners on every write of this process. It is counted again when it is asked at
+    another revision, after the writes of the other worker processes, so the count
+    matches the revision the responses are versioned by
+    """
+
+    def __init__(self):
+        self._count = None
+        self._revision = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._count = None
+
+    def get(self, revision):
+        """
+        Returns the number of questions at the revision of the questions
+        """
+        with self._lock:
+            if self._count is None or self._revision != revision:
+                self._count = db.session.query(func.count(Question.id)).scalar()
+                self._revision = revision
+            return self._count
+
+    def on_question_change(self, action, question):
+        if action == "reload":
+            self.invalidate()
+            return
+        with self._lock:
+            if self._count is None:
+                return
+            # the write bumped the revision once, a write of another process in between
+            # leaves the counter behind the revision and it is counted again
+            self._revision += 1
+            if action == "insert":
+                self._count += 1
+            elif action == "delete":
+                self._count -= 1
+
+
+question_counter = QuestionCounter()
+question_listeners.append(question_counter.on_question_change)
@@ -0,0 +1,64 @@
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from models import ContentRevision
+from .categories import category_registry
+from .snapshot import question_snapshot
+
+DEFAULT_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+
+
+def content_revision(name):
+    """
+    This function is used to get a revision of the content, read once per request, or
+    taken from the question snapshot when it is enabled. The category registry is
+    brought up to the revision of the categories, for the responses versioned by it
+    """
+    values = request.__dict__.setdefault("content_revisions", {})
+    if name not in values:
+        if question_snapshot.enabled:
+            values[name] = question_snapshot.get().revisions.get(name, 0)
+        else:
+            values[name] = ContentRevision.get(name)
+        if name == "categories":
+            category_registry.sync(values[name])
+    return values[name]
+
+
+def content_etag(revisions):
+    """
+    This function is used to build the ETag of a response from the revisions of the
+    content it is built from (see content_revision)
+    """
+    return "-".join("{}{}".format(name, content_revision(name)) for name in revisions)
+
+
+def conditional(*revisions):
+    """
+    Decorator making a GET view conditional, the response gets a weak ETag built from
+    the given content revisions (see ContentRevision) and a Cache-Control header, and a
+    request whose If-None-Match has that ETag is answered with 304 without running
+    the view
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = content_etag(revisions)
+            cache_control = current_app.config.get(
+                "HTTP_CACHE_CONTROL", DEFAULT_CACHE_CONTROL
+            )
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers["Cache-Control"] = cache_control
+            return response
+
+        return wrapper
+
+    return decorator
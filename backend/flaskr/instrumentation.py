@@ -0,0 +1,246 @@
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import g, has_request_context, request
+from flask.json import JSONEncoder
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import db
+
+
+class RequestMetrics:
+    """
+    What a request spent, filled by the engine and JSON encoder hooks
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.serialization_time = 0.0
+
+
+def current_metrics():
+    if has_request_context():
+        return getattr(g, "request_metrics", None)
+    return None
+
+
+def record_rows(count):
+    """
+    Adds rows fetched without the ORM (column projections) to the request metrics
+    """
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.rows += count
+
+
+def record_serialization(seconds):
+    """
+    Adds time spent encoding a response outside the JSON encoder of the app
+    """
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.serialization_time += seconds
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.queries += 1
+        metrics.db_time += elapsed
+
+
+@event.listens_for(db.Model, "load", propagate=True)
+def on_load(target, context):
+    record_rows(1)
+
+
+class TimedJSONEncoder(JSONEncoder):
+    """
+    The JSON encoder of the app, timing the serialization of the responses
+    """
+
+    def encode(self, o):
+        started = time.perf_counter()
+        try:
+            return super().encode(o)
+        finally:
+            record_serialization(time.perf_counter() - started)
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = Counter()
+        self.duration = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.serialization_time = 0.0
+
+
+class Instrumentation:
+    """
+    Records the query count, database time, serialization time and row count of every
+    request, sends them back in a Server-Timing header and aggregates them per route
+    for the Prometheus text format of GET /metrics. The numbers are per worker process
+    """
+
+    def __init__(self):
+        self.routes = defaultdict(RouteStats)
+        self.exporters = []
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.json_encoder = TimedJSONEncoder
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def add_exporter(self, exporter):
+        """
+        Registers a callable returning more Prometheus text lines for GET /metrics
+        """
+        self.exporters.append(exporter)
+
+    def before_request(self):
+        g.request_metrics = RequestMetrics()
+
+    def after_request(self, response):
+        metrics = current_metrics()
+        if metrics is None:
+            return response
+        duration = time.perf_counter() - metrics.started
+        response.headers["Server-Timing"] = (
+            'db;dur={:.3f};desc="{} queries, {} rows", serialize;dur={:.3f}, '
+            "total;dur={:.3f}".format(
+                metrics.db_time * 1000,
+                metrics.queries,
+                metrics.rows,
+                metrics.serialization_time * 1000,
+                duration * 1000,
+            )
+        )
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        with self._lock:
+            stats = self.routes[(request.method, rule)]
+            stats.requests[response.status_code] += 1
+            stats.duration += duration
+            stats.queries += metrics.queries
+            stats.db_time += metrics.db_time
+            stats.rows += metrics.rows
+            stats.serialization_time += metrics.serialization_time
+        return response
+
+    def render(self):
+        lines = []
+        families = [
+            ("trivia_requests_total", "Requests answered."),
+            ("trivia_request_duration_seconds_total", "Time spent in requests."),
+            ("trivia_db_queries_total", "SQL statements run."),
+            ("trivia_db_duration_seconds_total", "Time spent in SQL statements."),
+            ("trivia_db_rows_total", "Rows loaded from the database."),
+            ("trivia_serialization_seconds_total", "Time spent encoding responses."),
+        ]
+        with self._lock:
+            routes = sorted(self.routes.items())
+            for name, description in families:
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} counter".format(name))
+                for (method, rule), stats in routes:
+                    labels = 'method="{}",route="{}"'.format(method, rule)
+                    if name == "trivia_requests_total":
+                        for status, count in sorted(stats.requests.items()):
+                            lines.append(
+                                '{}{{{},status="{}"}} {}'.format(
+                                    name, labels, status, count
+                                )
+                            )
+                        continue
+                    value = {
+                        "trivia_request_duration_seconds_total": stats.duration,
+                        "trivia_db_queries_total": stats.queries,
+                        "trivia_db_duration_seconds_total": stats.db_time,
+                        "trivia_db_rows_total": stats.rows,
+                        "trivia_serialization_seconds_total": stats.serialization_time,
+                    }[name]
+                    lines.append("{}{{{}}} {}".format(name, labels, value))
+        for exporter in self.exporters:
+            lines.extend(exporter())
+        return "\n".join(lines) + "\n"
+
+    def metrics_view(self):
+        return self.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+instrumentation = Instrumentation()
+
+
+"""
+Query inspection for the tests
+"""
+
+FULL_TABLE_PATTERN = re.compile(r"\bFROM\s+(\w+)", re.IGNORECASE)
+
+
+class CapturedQueries(list):
+    """
+    The SQL statements run inside capture_queries
+    """
+
+    def repeated(self, threshold=3):
+        """
+        Returns the statements run `threshold` times or more, the signature of an N+1
+        """
+        return [
+            statement
+            for statement, count in Counter(self).items()
+            if count >= threshold
+        ]
+
+    def full_table_reads(self, table):
+        """
+        Returns the statements reading `table` without WHERE nor LIMIT
+        """
+        reads = []
+        for statement in self:
+            tables = FULL_TABLE_PATTERN.findall(statement)
+            upper = statement.upper()
+            if (
+                upper.lstrip().startswith("SELECT")
+                and table in tables
+                and " WHERE " not in upper
+                and " LIMIT " not in upper
+                and "COUNT(" not in upper
+            ):
+                reads.append(statement)
+        return reads
+
+
+@contextmanager
+def capture_queries():
+    """
+    Context manager collecting the SQL statements run by every engine
+    """
+    captured = CapturedQueries()
+
+    def collect(conn, cursor, statement, parameters, context, executemany):
+        captured.append(" ".join(statement.split()))
+
+    event.listen(Engine, "before_cursor_execute", collect)
+    try:
+        yield captured
+    finally:
+        event.remove(Engine, "before_cursor_execute", collect)
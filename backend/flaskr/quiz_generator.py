@@ -0,0 +1,295 @@
+import random
+import time
+from bisect import bisect_right
+from collections import Counter
+from itertools import accumulate
+from threading import Lock
+
+from models import db, Question, question_listeners
+
+MAX_QUIZ_QUESTIONS = 100
+
+
+class InvalidQuizSpec(ValueError):
+    pass
+
+
+class Bucket:
+    """
+    The question ids of one (category, difficulty), a list to draw from by position
+    and the position of every id so an id is added or removed in constant time
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, question_id):
+        if question_id not in self.positions:
+            self.positions[question_id] = len(self.ids)
+            self.ids.append(question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if last != question_id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def draw(self, rng, used, available):
+        """
+        Returns a random id of the bucket not in `used`, `available` is the number of
+        ids of the bucket not used yet
+        """
+        if available * 2 >= len(self.ids):
+            while True:
+                question_id = self.ids[rng.randrange(len(self.ids))]
+                if question_id not in used:
+                    return question_id
+        return rng.choice([i for i in self.ids if i not in used])
+
+
+def sample_unseen(rng, pools, excluded, available, count):
+    """
+    This function is used to draw `count` random ids of the pools (sequences of ids)
+    that are not excluded, fewer when there are not as many. `available` is the number
+    of ids of the pools not excluded. While at least half of the ids can still be drawn
+    an id is drawn by its position and drawn again when it is excluded, so a draw does
+    not read every id
+    """
+    count = min(count, available)
+    ends = list(accumulate(len(pool) for pool in pools))
+    total = ends[-1] if ends else 0
+    if (available - count) * 2 < total:
+        candidates = [i for pool in pools for i in pool if i not in excluded]
+        return rng.sample(candidates, count)
+    chosen = []
+    drawn = set()
+    while len(chosen) < count:
+        position = rng.randrange(total)
+        index = bisect_right(ends, position)
+        pool = pools[index]
+        question_id = pool[position - ends[index] + len(pool)]
+        if question_id not in excluded and question_id not in drawn:
+            drawn.add(question_id)
+            chosen.append(question_id)
+    return chosen
+
+
+def parse_weights(weights, name):
+    """
+    This function is used to read the {id: weight} object of a quiz spec, its keys
+    are strings in JSON
+    """
+    if not isinstance(weights, dict) or not weights:
+        raise InvalidQuizSpec("{} must be an object of weights".format(name))
+    parsed = {}
+    for key, weight in weights.items():
+        if isinstance(weight, bool):
+            raise InvalidQuizSpec("invalid {} weight {!r}".format(name, key))
+        try:
+            key = int(key)
+            weight = float(weight)
+        except (TypeError, ValueError):
+            raise InvalidQuizSpec("invalid {} weight {!r}".format(name, key))
+        if weight < 0:
+            raise InvalidQuizSpec("{} weights cannot be negative".format(name))
+        if weight > 0:
+            parsed[key] = weight
+    if not parsed:
+        raise InvalidQuizSpec("{} weights cannot all be zero".format(name))
+    return parsed
+
+
+class QuizGenerator:
+    """
+    Builds quizzes from a spec without querying the questions table for candidates.
+    The question ids are kept in memory in buckets per (category, difficulty), loaded
+    with one query of three columns and kept up to date by the question listeners of
+    this process, then loaded again after `ttl` seconds to pick up the writes of the
+    other worker processes. A quiz is drawn from the buckets and its questions are
+    read by primary key in one query
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._buckets = None
+        self._locations = {}
+        self._expires_at = 0
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get("QUIZ_BUCKETS_TTL", self.ttl)
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._buckets = None
+            self._locations = {}
+
+    def _ensure_loaded(self):
+        if self._buckets is None or time.monotonic() >= self._expires_at:
+            self._load()
+
+    def _load(self):
+        self._buckets = {}
+        self._locations = {}
+        rows = db.session.query(
+            Question.id, Question.category, Question.difficulty
+        ).order_by(Question.id)
+        for question_id, category, difficulty in rows:
+            self._add(question_id, category, difficulty)
+        self._expires_at = time.monotonic() + self.ttl
+
+    def _add(self, question_id, category, difficulty):
+        location = (category, difficulty)
+        self._buckets.setdefault(location, Bucket()).add(question_id)
+        self._locations[question_id] = location
+
+    def _remove(self, question_id):
+        location = self._locations.pop(question_id, None)
+        if location is not None:
+            self._buckets[location].remove(question_id)
+
+    def on_question_change(self, action, question):
+        if action == "reload":
+            self.invalidate()
+            return
+        with self._lock:
+            if self._buckets is None:
+                return
+            self._remove(question["id"])
+            if action in ("insert", "update"):
+                self._add(question["id"], question["category"], question["difficulty"])
+
+    def sample(self, category, excluded, count):
+        """
+        Returns `count` random question ids of the category, of all the questions when
+        the category is None, whose ids are not in the `excluded` set, and the number of
+        ids left after them. The ids are drawn from the buckets of the category, so
+        a draw costs about the same whatever the number of questions
+        """
+        with self._lock:
+            self._ensure_loaded()
+            pools = [
+                bucket.ids
+                for (bucket_category, _), bucket in self._buckets.items()
+                if category is None or bucket_category == category
+            ]
+            excluded_count = 0
+            for question_id in excluded:
+                location = self._locations.get(question_id)
+                if location is not None and category in (None, location[0]):
+                    excluded_count += 1
+            available = sum(len(pool) for pool in pools) - excluded_count
+            chosen = sample_unseen(random, pools, excluded, available, count)
+        return chosen, available - len(chosen)
+
+    def parse_spec(self, spec, categories):
+        """
+        Validates a quiz spec against the {id: type} categories:
+        - count: number of questions, 1 to MAX_QUIZ_QUESTIONS
+        - categories: optional {category id: weight}, every category equally by default
+        - difficulties: optional {difficulty: weight}, or "ramp" to go from the easiest
+          to the hardest difficulty over the quiz, every difficulty equally by default
+        - seed: optional integer, a seed gives the same quiz while the questions
+          do not change
+        """
+        if not isinstance(spec, dict):
+            raise InvalidQuizSpec("the quiz spec must be an object")
+        count = spec.get("count")
+        # a JSON boolean is an int in Python
+        if (
+            not isinstance(count, int)
+            or isinstance(count, bool)
+            or not 1 <= count <= MAX_QUIZ_QUESTIONS
+        ):
+            raise InvalidQuizSpec(
+                "count must be between 1 and {}".format(MAX_QUIZ_QUESTIONS)
+            )
+        if spec.get("categories") is None:
+            category_weights = {category: 1.0 for category in categories}
+        else:
+            category_weights = parse_weights(spec["categories"], "category")
+            unknown = set(category_weights) - set(categories)
+            if unknown:
+                raise InvalidQuizSpec("unknown categories {}".format(sorted(unknown)))
+        difficulties = spec.get("difficulties")
+        if difficulties is not None and difficulties != "ramp":
+            difficulties = parse_weights(difficulties, "difficulty")
+        seed = spec.get("seed")
+        if seed is None:
+            seed = random.getrandbits(32)
+        elif not isinstance(seed, int) or isinstance(seed, bool):
+            raise InvalidQuizSpec("seed must be an integer")
+        return count, category_weights, difficulties, seed
+
+    def _targets(self, rng, count, difficulties, known):
+        """
+        Returns the difficulty wanted for each question of the quiz
+        """
+        if difficulties == "ramp":
+            lowest, highest = min(known), max(known)
+            if count == 1:
+                return [lowest]
+            return [
+                round(lowest + (highest - lowest) * index / (count - 1))
+                for index in range(count)
+            ]
+        if difficulties is None:
+            difficulties = {difficulty: 1.0 for difficulty in known}
+        choices = list(difficulties)
+        weights = [difficulties[difficulty] for difficulty in choices]
+        return rng.choices(choices, weights, k=count)
+
+    def generate(self, count, category_weights, difficulties, seed):
+        """
+        Returns the question ids of a quiz. Each question is drawn from a category
+        picked by weight among the buckets of the wanted difficulty, or of the closest
+        difficulty with questions left. The quiz is shorter than `count` when there
+        are not enough questions
+        """
+        rng = random.Random(seed)
+        used = set()
+        taken = Counter()
+        quiz = []
+        with self._lock:
+            self._ensure_loaded()
+            by_difficulty = {}
+            for location in sorted(
+                location
+                for location, bucket in self._buckets.items()
+                if location[0] in category_weights and len(bucket)
+            ):
+                by_difficulty.setdefault(location[1], []).append(location)
+            known = sorted(by_difficulty)
+            if not known:
+                return quiz
+            for target in self._targets(rng, count, difficulties, known):
+                for difficulty in sorted(known, key=lambda d: (abs(d - target), d)):
+                    locations = [
+                        location
+                        for location in by_difficulty[difficulty]
+                        if len(self._buckets[location]) > taken[location]
+                    ]
+                    if not locations:
+                        continue
+                    location = rng.choices(
+                        locations, [category_weights[c] for c, d in locations]
+                    )[0]
+                    bucket = self._buckets[location]
+                    question_id = bucket.draw(rng, used, len(bucket) - taken[location])
+                    taken[location] += 1
+                    used.add(question_id)
+                    quiz.append(question_id)
+                    break
+        return quiz
+
+
+quiz_generator = QuizGenerator()
+question_listeners.append(quiz_generator.on_question_change)
@@ -0,0 +1,179 @@
+import secrets
+import time
+from array import array
+from collections import OrderedDict
+from random import shuffle
+from threading import Lock
+
+from models import Question
+from .snapshot import questions_by_id
+
+
+class MemorySessionStore:
+    """
+    Default quiz session store, keeps the sessions in this process until they expire and
+    drops the least recently used ones above `max_sessions`. The keys of a session, the
+    part of a key before its last ":", are kept and dropped together, so the order of a
+    session never outlives its position. Any client with the same redis-like
+    get/set/delete/incrby/expire interface can be configured instead so the sessions
+    are shared by the worker processes
+    """
+
+    def __init__(self, max_sessions=100000):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = Lock()
+
+    def _entry(self, key):
+        """
+        Returns the session and the field of the key, and the (value, expires at) of
+        the key or None when it is missing or expired, the caller holds the lock
+        """
+        session, _, field = key.rpartition(":")
+        fields = self._sessions.get(session)
+        if fields is None or field not in fields:
+            return session, field, None
+        if time.monotonic() >= fields[field][1]:
+            self._pop(session, field)
+            return session, field, None
+        self._sessions.move_to_end(session)
+        return session, field, fields[field]
+
+    def _put(self, session, field, value, expires_at):
+        self._sessions.setdefault(session, {})[field] = (value, expires_at)
+        self._sessions.move_to_end(session)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _pop(self, session, field):
+        fields = self._sessions.get(session)
+        if fields is not None:
+            fields.pop(field, None)
+            if not fields:
+                del self._sessions[session]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entry(key)[2]
+            return None if entry is None else entry[0]
+
+    def set(self, key, value, ex=None):
+        expires_at = time.monotonic() + ex if ex is not None else float("inf")
+        session, _, field = key.rpartition(":")
+        with self._lock:
+            self._put(session, field, value, expires_at)
+
+    def delete(self, key):
+        session, _, field = key.rpartition(":")
+        with self._lock:
+            self._pop(session, field)
+
+    def incrby(self, key, amount):
+        """
+        Adds to the integer of the key and returns it, as one step. A missing key
+        starts at 0 and does not expire
+        """
+        with self._lock:
+            session, field, entry = self._entry(key)
+            value, expires_at = entry or (0, float("inf"))
+            value = int(value) + amount
+            self._put(session, field, value, expires_at)
+            return value
+
+    def expire(self, key, seconds):
+        with self._lock:
+            session, field, entry = self._entry(key)
+            if entry is None:
+                return False
+            self._put(session, field, entry[0], time.monotonic() + seconds)
+            return True
+
+
+class QuizSessions:
+    """
+    Server-side quiz sessions, the question ids of the quiz are shuffled once when the
+    session starts and stored as packed 32-bit integers, next to the position of the
+    next question. The ids are read through a memoryview without being copied, and the
+    questions are claimed by moving the position with an atomic increment, so two
+    concurrent requests of a session never get the same question. Every next question
+    is a store lookup, a store increment, one primary key read and the refresh of the
+    expiry of the session
+    """
+
+    key_prefix = "trivia:quiz:"
+
+    def __init__(self):
+        self.store = MemorySessionStore()
+        self.ttl = 3600
+
+    def init_app(self, app):
+        self.ttl = app.config.get("QUIZ_SESSION_TTL", self.ttl)
+        self.store = app.config.get("QUIZ_SESSION_STORE") or MemorySessionStore()
+
+    def start(self, selection):
+        """
+        Starts a session over the questions of the query and returns its id and the
+        number of questions
+        """
+        rows = selection.with_entities(Question.id)
+        return self.start_ids(question_id for question_id, in rows)
+
+    def start_ids(self, question_ids):
+        """
+        Starts a session over the question ids and returns its id and the number of
+        questions
+        """
+        question_ids = array("i", question_ids)
+        shuffle(question_ids)
+        session_id = secrets.token_urlsafe(16)
+        key = self.key_prefix + session_id
+        self.store.set(key + ":order", question_ids.tobytes(), ex=self.ttl)
+        self.store.set(key + ":position", 0, ex=self.ttl)
+        return session_id, len(question_ids)
+
+    def next(self, session_id):
+        """
+        Returns the next question of the session, None when the quiz is over, and the
+        number of questions left after it. Returns None if there is no such session.
+        Questions deleted since the session started are skipped
+        """
+        result = self.take(session_id, 1)
+        if result is None:
+            return None
+        questions, remaining = result
+        return (questions[0] if questions else None), remaining
+
+    def take(self, session_id, count):
+        """
+        Returns the next `count` questions of the session, fewer at the end of the quiz,
+        and the number of questions left after them, reading them in one query.
+        Returns None if there is no such session. Questions deleted since the session
+        started are skipped
+        """
+        key = self.key_prefix + session_id
+        order = self.store.get(key + ":order")
+        if order is None:
+            return None
+        question_ids = memoryview(order).cast("i")
+        questions = []
+        position = 0
+        while len(questions) < count:
+            wanted = count - len(questions)
+            position = self.store.incrby(key + ":position", wanted)
+            if position - wanted >= len(question_ids):
+                break
+            questions.extend(
+                questions_by_id(question_ids[position - wanted : position].tolist())
+            )
+        # the session lives `ttl` seconds after its last question
+        self.store.expire(key + ":order", self.ttl)
+        self.store.expire(key + ":position", self.ttl)
+        return questions, max(len(question_ids) - position, 0)
+
+    def end(self, session_id):
+        key = self.key_prefix + session_id
+        self.store.delete(key + ":order")
+        self.store.delete(key + ":position")
+
+
+quiz_sessions = QuizSessions()
@@ -0,0 +1,132 @@
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, make_response, request
+
+from models import question_listeners
+from .http_cache import content_etag
+
+
+class MemoryResponseStore:
+    """
+    Default response cache store, keeps the responses in this process and drops the
+    least recently used ones once they take more than `max_bytes`. It has the same
+    redis-like get/set/delete interface as the clients that can be configured instead
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ex=None):
+        expires_at = time.monotonic() + ex if ex is not None else float("inf")
+        with self._lock:
+            self._pop(key)
+            if len(key) + len(value) > self.max_bytes:
+                return
+            self._entries[key] = (value, expires_at)
+            self.size += len(key) + len(value)
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(key) + len(entry[0])
+
+
+class ResponseCache:
+    """
+    Cache of whole GET responses, keyed by the path, the query arguments and the
+    revisions of the content the response is built from (see ContentRevision). A write
+    bumps a revision, so the responses built before it are never served again and age
+    out of the store. The in-process store is also emptied by the question listeners
+    so it does not keep the stale responses of this worker. The key is left on the
+    responses as `cache_key`, for the compression to keep the compressed bodies next
+    to them
+    """
+
+    key_prefix = "trivia:response:"
+
+    def __init__(self):
+        self.store = MemoryResponseStore()
+        self.ttl = 300
+
+    def init_app(self, app):
+        self.ttl = app.config.get("RESPONSE_CACHE_TTL", self.ttl)
+        self.store = app.config.get("RESPONSE_CACHE_STORE") or MemoryResponseStore(
+            app.config.get("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+        )
+
+    def key(self, revisions):
+        query = "&".join(
+            "{}={}".format(name, value)
+            for name, value in sorted(request.args.items(multi=True))
+        )
+        return "{}{}?{}#{}".format(
+            self.key_prefix, request.path, query, content_etag(revisions)
+        )
+
+    def cached(self, *revisions):
+        """
+        Decorator caching the 200 responses of a GET view, the given content revisions
+        are part of the key
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                key = self.key(revisions)
+                cached = self.store.get(key)
+                if cached is not None:
+                    mimetype, _, body = cached.partition(b"\n")
+                    response = current_app.response_class(
+                        body, mimetype=mimetype.decode()
+                    )
+                    response.headers["X-Cache"] = "HIT"
+                    response.cache_key = key
+                    return response
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    value = response.mimetype.encode() + b"\n" + response.get_data()
+                    self.store.set(key, value, ex=self.ttl)
+                    response.headers["X-Cache"] = "MISS"
+                    response.cache_key = key
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def on_question_change(self, action, question):
+        if isinstance(self.store, MemoryResponseStore):
+            self.store.clear()
+
+
+response_cache = ResponseCache()
+question_listeners.append(response_cache.on_question_change)
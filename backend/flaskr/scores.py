@@ -0,0 +1,287 @@
+import atexit
+import os
+import time
+from bisect import bisect_left, insort
+from threading import Event, Lock, Thread
+
+from sqlalchemy import and_, bindparam, func
+
+from models import db, Player, Score
+
+# Category of the leaderboard summing the points of every category
+ALL_CATEGORIES = 0
+
+
+class Leaderboard:
+    """
+    Points of every player of a category and the top `size` of them, kept as a sorted
+    list of (-points, player id) updated in place. Points only grow, so a player out of
+    the top can only get back in by scoring
+    """
+
+    def __init__(self, totals, size):
+        self.totals = totals
+        self.size = size
+        self.top = sorted((-points, player_id) for player_id, points in totals.items())
+        del self.top[size:]
+
+    def add(self, player_id, points):
+        old = self.totals.get(player_id, 0)
+        self.totals[player_id] = old + points
+        index = bisect_left(self.top, (-old, player_id))
+        if index < len(self.top) and self.top[index] == (-old, player_id):
+            del self.top[index]
+        insort(self.top, (-(old + points), player_id))
+        del self.top[self.size :]
+
+    def ranking(self, limit):
+        return [(player_id, -points) for points, player_id in self.top[:limit]]
+
+
+class Scores:
+    """
+    Write-behind score keeping. A submission adds its points to a buffer in memory and
+    to the leaderboards of this worker, the buffer is written to the scores table in one
+    transaction every `flush_interval` seconds by a background thread (sooner when it
+    holds `max_pending` entries) and when the process exits. The thread is started by
+    the first submission of each process, so the workers forked from the process that
+    created the app (gunicorn --preload) run their own.
+
+    The leaderboards are loaded from the scores table on first use and then updated by
+    the submissions of this worker, they are loaded again after `ttl` seconds to pick
+    up the scores of the other worker processes. Points not yet flushed are lost if the
+    process is killed
+    """
+
+    def __init__(self):
+        self.flush_interval = 5
+        self.max_pending = 10000
+        self.ttl = 60
+        self.size = 100
+        self._pending = {}
+        self._boards = {}
+        self._names = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wake = Event()
+        self._stopping = None
+        self._thread = None
+        self._pid = None
+        self._app = None
+        self._thread_lock = Lock()
+        atexit.register(self.stop)
+
+    def init_app(self, app):
+        self.stop()
+        self.flush_interval = app.config.get("SCORE_FLUSH_INTERVAL", 5)
+        self.max_pending = app.config.get("SCORE_MAX_PENDING", 10000)
+        self.ttl = app.config.get("LEADERBOARD_TTL", 60)
+        self.size = app.config.get("LEADERBOARD_SIZE", 100)
+        with self._lock:
+            self._boards = {}
+            self._names = {}
+        self._app = app
+
+    def _start(self):
+        """
+        Starts the background thread of this process unless it runs already, a thread
+        started before a fork does not run in the child
+        """
+        if not self.flush_interval or self._app is None:
+            return
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = Event()
+            self._wake = Event()
+            self._thread = Thread(
+                target=self._run,
+                args=(self._app, self.flush_interval, self._stopping),
+                name="score-flusher",
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self, app, interval, stopping):
+        while not stopping.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception("Writing the buffered scores failed")
+
+    def stop(self):
+        """
+        Stops the background thread of this process after a last flush of the buffer,
+        which is written here when no thread of this process runs
+        """
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            self._stopping.set()
+            self._wake.set()
+            thread.join()
+        self._thread = None
+        if self._pending and self._app is not None:
+            with self._app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    self._app.logger.exception("Writing the buffered scores failed")
+
+    def player_name(self, player_id):
+        """
+        Returns the name of the player, None if there is no such player. The names are
+        kept in memory once read
+        """
+        with self._lock:
+            if player_id in self._names:
+                return self._names[player_id]
+        player = Player.query.get(player_id)
+        if player is None:
+            return None
+        with self._lock:
+            self._names[player_id] = player.name
+        return player.name
+
+    def add_player(self, player):
+        with self._lock:
+            self._names[player.id] = player.name
+
+    def record(self, player_id, category, points):
+        """
+        Adds the points of an answered question of the category to the buffer and to
+        the leaderboards, without writing to the database
+        """
+        self._start()
+        key = (player_id, category)
+        with self._lock:
+            buffered_points, answered = self._pending.get(key, (0, 0))
+            self._pending[key] = (buffered_points + points, answered + 1)
+            for board_category in (category, ALL_CATEGORIES):
+                board = self._boards.get(board_category)
+                if board is not None:
+                    board[0].add(player_id, points)
+            pending = len(self._pending)
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Writes the buffered scores in one transaction and returns the number of rows
+        written. The buffer is kept for the next flush if the transaction fails
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            scores = Score.__table__
+            try:
+                existing = set(
+                    db.session.query(Score.player_id, Score.category).filter(
+                        Score.player_id.in_({player_id for player_id, _ in pending})
+                    )
+                )
+                rows = [
+                    {
+                        "b_player_id": player_id,
+                        "b_category": category,
+                        "b_points": points,
+                        "b_answered": answered,
+                    }
+                    for (player_id, category), (points, answered) in pending.items()
+                ]
+                updates = [
+                    row
+                    for row in rows
+                    if (row["b_player_id"], row["b_category"]) in existing
+                ]
+                inserts = [
+                    {
+                        "player_id": row["b_player_id"],
+                        "category": row["b_category"],
+                        "points": row["b_points"],
+                        "answered": row["b_answered"],
+                    }
+                    for row in rows
+                    if (row["b_player_id"], row["b_category"]) not in existing
+                ]
+                if updates:
+                    db.session.execute(
+                        scores.update()
+                        .where(
+                            and_(
+                                scores.c.player_id == bindparam("b_player_id"),
+                                scores.c.category == bindparam("b_category"),
+                            )
+                        )
+                        .values(
+                            points=scores.c.points + bindparam("b_points"),
+                            answered=scores.c.answered + bindparam("b_answered"),
+                        ),
+                        updates,
+                    )
+                if inserts:
+                    db.session.execute(scores.insert(), inserts)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    for key, (points, answered) in pending.items():
+                        buffered_points, buffered_answered = self._pending.get(
+                            key, (0, 0)
+                        )
+                        self._pending[key] = (
+                            buffered_points + points,
+                            buffered_answered + answered,
+                        )
+                raise
+            return len(pending)
+
+    def _load(self, category):
+        """
+        Builds the leaderboard of the category from the scores table and the buffer,
+        while no flush is writing the buffer
+        """
+        query = db.session.query(Score.player_id, Player.name, func.sum(Score.points))
+        query = query.join(Player, Player.id == Score.player_id)
+        if category != ALL_CATEGORIES:
+            query = query.filter(Score.category == category)
+        rows = query.group_by(Score.player_id, Player.name).all()
+        totals = {}
+        with self._lock:
+            for player_id, name, points in rows:
+                totals[player_id] = int(points)
+                self._names[player_id] = name
+            for (player_id, score_category), (points, _) in self._pending.items():
+                if category in (ALL_CATEGORIES, score_category):
+                    totals[player_id] = totals.get(player_id, 0) + points
+            board = (Leaderboard(totals, self.size), time.monotonic() + self.ttl)
+            self._boards[category] = board
+        return board
+
+    def leaderboard(self, category, limit):
+        """
+        Returns the top `limit` players of the category as dicts of the player id, name
+        and points, ALL_CATEGORIES for the points of every category
+        """
+        with self._lock:
+            board = self._boards.get(category)
+        if board is None or time.monotonic() >= board[1]:
+            with self._flush_lock:
+                board = self._load(category)
+        with self._lock:
+            ranking = board[0].ranking(limit)
+            names = dict(self._names)
+        return [
+            {"player_id": player_id, "name": names.get(player_id), "points": points}
+            for player_id, points in ranking
+        ]
+
+
+scores = Scores()
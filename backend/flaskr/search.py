@@ -0,0 +1,191 @@
+from threading import Lock
+
+from sqlalchemy import func, or_
+
+from models import db, Question, question_listeners
+from .instrumentation import record_rows
+from .serialization import QUESTION_COLUMNS, QUESTION_FIELDS, project_questions
+
+
+def escape_like(term):
+    """
+    Escape the LIKE wildcards so the search term is matched as a plain substring
+    """
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class SQLSearchBackend:
+    """
+    Searches the question and answer text with ILIKE, the page and the total number
+    of matches are fetched together with a COUNT(*) OVER () window column
+    """
+
+    def matches(self, search_term):
+        pattern = "%{}%".format(escape_like(search_term))
+        return or_(
+            Question.question.ilike(pattern, escape="\\"),
+            Question.answer.ilike(pattern, escape="\\"),
+        )
+
+    def order_by(self, search_term):
+        return [Question.id]
+
+    def search(self, search_term, page, per_page):
+        if page < 1:
+            return [], 0
+        selection = Question.query.filter(self.matches(search_term))
+        rows = (
+            selection.with_entities(*QUESTION_COLUMNS, func.count(Question.id).over())
+            .order_by(*self.order_by(search_term))
+            .offset((page - 1) * per_page)
+            .limit(per_page)
+            .all()
+        )
+        if rows:
+            record_rows(len(rows))
+            questions = [dict(zip(QUESTION_FIELDS, row)) for row in rows]
+            return questions, rows[0][-1]
+        # Beyond the last page there is no row to carry the total
+        total = selection.with_entities(func.count(Question.id)).scalar()
+        return [], total
+
+    def on_question_change(self, action, question):
+        pass
+
+
+class PostgresSearchBackend(SQLSearchBackend):
+    """
+    The SQL search on PostgreSQL, the ILIKE filters are served by the pg_trgm GIN
+    indexes of migrations/0001_search_trigram_indexes.sql and the matches are ranked
+    by how closely the term matches a word of the question or the answer
+    """
+
+    def order_by(self, search_term):
+        rank = func.greatest(
+            func.word_similarity(search_term, Question.question),
+            func.word_similarity(search_term, Question.answer),
+        )
+        return [rank.desc(), Question.id]
+
+
+class MemorySearchBackend:
+    """
+    In-memory trigram inverted index of the question and answer text, used with SQLite
+    and in the tests. A term of three characters or more is looked up in the postings
+    of its trigrams and the candidates are then checked for the whole substring, so it
+    returns the same questions as the SQL search. The index is built on the first search
+    and kept up to date through the question listeners
+    """
+
+    def __init__(self):
+        self._documents = None
+        self._postings = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def trigrams(text):
+        return {text[i : i + 3] for i in range(len(text) - 2)}
+
+    def _add(self, question):
+        text = "{}\n{}".format(question["question"] or "", question["answer"] or "")
+        text = text.lower()
+        self._documents[question["id"]] = text
+        for trigram in self.trigrams(text):
+            self._postings.setdefault(trigram, set()).add(question["id"])
+
+    def _remove(self, question_id):
+        text = self._documents.pop(question_id, None)
+        if text is None:
+            return
+        for trigram in self.trigrams(text):
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                postings.discard(question_id)
+                if not postings:
+                    del self._postings[trigram]
+
+    def _build(self):
+        self._documents = {}
+        self._postings = {}
+        rows = db.session.query(Question.id, Question.question, Question.answer)
+        for question_id, question, answer in rows:
+            self._add({"id": question_id, "question": question, "answer": answer})
+
+    def invalidate(self):
+        with self._lock:
+            self._documents = None
+            self._postings = {}
+
+    def search(self, search_term, page, per_page):
+        if page < 1:
+            return [], 0
+        term = search_term.lower()
+        with self._lock:
+            if self._documents is None:
+                self._build()
+            if len(term) >= 3:
+                postings = [self._postings.get(t, set()) for t in self.trigrams(term)]
+                candidates = set.intersection(*sorted(postings, key=len))
+            else:
+                candidates = self._documents.keys()
+            matched = sorted(
+                question_id
+                for question_id in candidates
+                if term in self._documents[question_id]
+            )
+        page_ids = matched[(page - 1) * per_page : page * per_page]
+        if not page_ids:
+            return [], len(matched)
+        questions = project_questions(
+            Question.query.filter(Question.id.in_(page_ids)).order_by(Question.id)
+        )
+        return questions, len(matched)
+
+    def on_question_change(self, action, question):
+        if action == "reload":
+            self.invalidate()
+            return
+        with self._lock:
+            if self._documents is None:
+                return
+            self._remove(question["id"])
+            if action != "delete":
+                self._add(question)
+
+
+class QuestionSearch:
+    """
+    Picks the search backend of the app from the SEARCH_BACKEND config, "postgres",
+    "sql" or "memory". By default PostgreSQL databases use the ranked trigram search
+    and the other databases use the plain SQL search
+    """
+
+    backends = {
+        "sql": SQLSearchBackend,
+        "postgres": PostgresSearchBackend,
+        "memory": MemorySearchBackend,
+    }
+
+    def __init__(self):
+        self.backend = SQLSearchBackend()
+
+    def init_app(self, app):
+        name = app.config.get("SEARCH_BACKEND")
+        if name is None:
+            is_postgres = app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgres")
+            name = "postgres" if is_postgres else "sql"
+        self.backend = self.backends[name]()
+
+    def search(self, search_term, page, per_page):
+        """
+        Returns the formatted questions of the page matching the search term and the
+        total number of matching questions
+        """
+        return self.backend.search(search_term, page, per_page)
+
+    def on_question_change(self, action, question):
+        self.backend.on_question_change(action, question)
+
+
+question_search = QuestionSearch()
+question_listeners.append(question_search.on_question_change)
@@ -0,0 +1,117 @@
+import re
+import time
+
+from flask import current_app, jsonify
+
+from models import Question
+from .instrumentation import record_rows, record_serialization
+
+try:
+    import orjson
+except ImportError:  # optional, the responses are encoded by Flask without it
+    orjson = None
+
+QUESTION_FIELDS = ("id", "question", "answer", "category", "difficulty")
+QUESTION_COLUMNS = tuple(getattr(Question, field) for field in QUESTION_FIELDS)
+
+# Bytes the stdlib encoder escapes as \uXXXX when JSON_AS_ASCII is on
+ESCAPED_BYTES = re.compile(b"[\x7f-\xff]")
+
+
+def project_questions(selection):
+    """
+    This function is used to fetch the questions of a query as the dicts of
+    Question.format(), reading only their columns as tuples instead of loading
+    ORM objects
+    """
+    rows = selection.with_entities(*QUESTION_COLUMNS).all()
+    record_rows(len(rows))
+    return [dict(zip(QUESTION_FIELDS, row)) for row in rows]
+
+
+def project_questions_by_id(question_ids):
+    """
+    This function is used to fetch the questions of the ids in one query, in the order
+    of the ids and without the ids of no question
+    """
+    selection = Question.query.filter(Question.id.in_(question_ids))
+    by_id = {question["id"]: question for question in project_questions(selection)}
+    return [by_id[question_id] for question_id in question_ids if question_id in by_id]
+
+
+class ResponseEncoder:
+    """
+    Encodes the JSON responses of the listing endpoints with orjson when it is installed,
+    and with the encoder of Flask otherwise. The bytes are the same as jsonify: keys
+    sorted (JSON_SORT_KEYS), no spaces, ASCII only (JSON_AS_ASCII) and a final newline.
+    Anything orjson would encode differently (non-ASCII text, non-str keys other than
+    the integer ids of the categories, types it does not know) goes to jsonify. The
+    listing payloads have no floats, whose exponents orjson writes differently
+    """
+
+    def __init__(self):
+        self.backend = "orjson" if orjson is not None else "stdlib"
+
+    def init_app(self, app):
+        backend = app.config.get("JSON_BACKEND")
+        if backend is None:
+            backend = "orjson" if orjson is not None else "stdlib"
+        if backend == "orjson" and orjson is None:
+            raise RuntimeError("JSON_BACKEND is orjson but orjson is not installed")
+        self.backend = backend
+
+    def _options(self):
+        options = (
+            orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | orjson.OPT_PASSTHROUGH_SUBCLASS
+        )
+        if current_app.config["JSON_SORT_KEYS"]:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def _encode(self, value, options):
+        try:
+            return orjson.dumps(value, option=options)
+        except TypeError:
+            if not isinstance(value, dict) or not all(
+                isinstance(key, (str, int)) and not isinstance(key, bool)
+                for key in value
+            ):
+                raise
+        # A dict with integer keys (the categories by id) is sorted on the integers
+        # and then written with string keys, as the stdlib encoder does
+        items = value.items()
+        if options & orjson.OPT_SORT_KEYS:
+            items = sorted(items)
+        return (
+            b"{"
+            + b",".join(
+                orjson.dumps(str(key)) + b":" + self._encode(item, options)
+                for key, item in items
+            )
+            + b"}"
+        )
+
+    def jsonify(self, payload):
+        config = current_app.config
+        if (
+            self.backend != "orjson"
+            or config["JSONIFY_PRETTYPRINT_REGULAR"]
+            or current_app.debug
+        ):
+            return jsonify(payload)
+        started = time.perf_counter()
+        try:
+            body = self._encode(payload, self._options())
+        except TypeError:
+            return jsonify(payload)
+        if config["JSON_AS_ASCII"] and ESCAPED_BYTES.search(body):
+            return jsonify(payload)
+        record_serialization(time.perf_counter() - started)
+        return current_app.response_class(
+            body + b"\n", mimetype=config["JSONIFY_MIMETYPE"]
+        )
+
+
+response_encoder = ResponseEncoder()
@@ -0,0 +1,307 @@
+import copy
+import random
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import Lock
+
+from models import db, ContentRevision, Question, QuestionChange, question_listeners
+from .quiz_generator import sample_unseen
+from .serialization import QUESTION_COLUMNS, QUESTION_FIELDS, project_questions_by_id
+
+# Stands for NULL in the integer columns of a snapshot
+NULL = -(2 ** 63)
+NO_IDS = array("q")
+
+
+# The columns of a snapshot, in the order of column_values
+COLUMNS = ("ids", "questions", "answers", "categories", "difficulties", "texts")
+
+
+def intern_text(text):
+    return sys.intern(text) if text is not None else None
+
+
+def column_values(row):
+    """
+    This function is used to get the values of a (id, question, answer, category,
+    difficulty) row in the columns of a snapshot
+    """
+    return (
+        row[0],
+        intern_text(row[1]),
+        intern_text(row[2]),
+        NULL if row[3] is None else row[3],
+        NULL if row[4] is None else row[4],
+        # searched as ILIKE does, the question and the answer lowered
+        "{}\0{}".format(row[1] or "", row[2] or "").lower(),
+    )
+
+
+def has_id(question_ids, question_id):
+    position = bisect_left(question_ids, question_id)
+    return position < len(question_ids) and question_ids[position] == question_id
+
+
+class Snapshot:
+    """
+    Read-only columnar copy of the questions ordered by id: the ids, categories and
+    difficulties in arrays of 64-bit integers, the text in lists of interned strings,
+    and the ids of each category in an array of their own. A snapshot is never
+    changed, applying changes builds a new one so the requests holding the old one
+    keep reading it
+    """
+
+    def __init__(self, rows, revisions, change_id):
+        rows = sorted(rows, key=lambda row: row[0])
+        columns = list(zip(*map(column_values, rows))) or [()] * len(COLUMNS)
+        self.ids = array("q", columns[0])
+        self.questions = list(columns[1])
+        self.answers = list(columns[2])
+        self.categories = array("q", columns[3])
+        self.difficulties = array("q", columns[4])
+        self.texts = list(columns[5])
+        self.by_category = {}
+        for question_id, category in zip(self.ids, self.categories):
+            if category != NULL:
+                self.by_category.setdefault(category, array("q")).append(question_id)
+        self.revisions = revisions
+        self.change_id = change_id
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, position):
+        category = self.categories[position]
+        difficulty = self.difficulties[position]
+        return (
+            self.ids[position],
+            self.questions[position],
+            self.answers[position],
+            None if category == NULL else category,
+            None if difficulty == NULL else difficulty,
+        )
+
+    def get_many(self, question_ids):
+        """
+        Returns the questions of the ids as the dicts of Question.format(), in the order
+        of the ids and without the ids of no question
+        """
+        questions = []
+        for question_id in question_ids:
+            position = bisect_left(self.ids, question_id)
+            if position < len(self.ids) and self.ids[position] == question_id:
+                questions.append(dict(zip(QUESTION_FIELDS, self.row(position))))
+        return questions
+
+    def category_ids(self, category=None):
+        """
+        Returns the ids of the questions of the category, of all the questions when the
+        category is None
+        """
+        if category is None:
+            return self.ids
+        return self.by_category.get(category, NO_IDS)
+
+    def count(self, category=None):
+        return len(self.category_ids(category))
+
+    def page(self, category, page, after_id, per_page):
+        """
+        Returns a page of the questions of the category as pagination_questions, by
+        page number or after the id of the last question of the previous page
+        """
+        question_ids = self.category_ids(category)
+        if after_id is not None:
+            start = bisect_right(question_ids, after_id)
+        elif page < 1:
+            return []
+        else:
+            start = (page - 1) * per_page
+        return self.get_many(question_ids[start : start + per_page])
+
+    def search(self, search_term, page, per_page):
+        """
+        Returns a page of the questions whose question or answer contains the term,
+        ignoring case, ordered by id, and the number of matches
+        """
+        if page < 1:
+            return [], 0
+        term = search_term.lower()
+        positions = [
+            position for position, text in enumerate(self.texts) if term in text
+        ]
+        start = (page - 1) * per_page
+        questions = [
+            dict(zip(QUESTION_FIELDS, self.row(position)))
+            for position in positions[start : start + per_page]
+        ]
+        return questions, len(positions)
+
+    def sample(self, category, excluded, count):
+        """
+        Returns `count` random questions of the category whose ids are not excluded,
+        and the number of questions left, drawn as QuizGenerator.sample
+        """
+        question_ids = self.category_ids(category)
+        available = len(question_ids) - sum(
+            1 for question_id in excluded if has_id(question_ids, question_id)
+        )
+        chosen = sample_unseen(random, [question_ids], excluded, available, count)
+        return self.get_many(chosen), available - len(chosen)
+
+    def apply(self, rows, deleted_ids, revisions, change_id):
+        """
+        Returns a new snapshot with the changed rows and without the deleted ids. The
+        columns are copied and only the positions of the changed ids are patched, the
+        id arrays of the categories without changes are shared with this snapshot
+        """
+        snapshot = copy.copy(self)
+        for name in COLUMNS:
+            column = getattr(self, name)
+            setattr(snapshot, name, column[:])
+        snapshot.by_category = dict(self.by_category)
+        copied = set()
+
+        def category_ids(category):
+            if category not in copied:
+                copied.add(category)
+                snapshot.by_category[category] = array(
+                    "q", self.by_category.get(category, NO_IDS)
+                )
+            return snapshot.by_category[category]
+
+        changed = {row[0]: column_values(row) for row in rows}
+        for question_id in sorted(set(changed) | set(deleted_ids)):
+            values = changed.get(question_id)
+            position = bisect_left(snapshot.ids, question_id)
+            found = (
+                position < len(snapshot.ids) and snapshot.ids[position] == question_id
+            )
+            old_category = snapshot.categories[position] if found else NULL
+            new_category = values[3] if values is not None else NULL
+            if found and values is not None:
+                for name, value in zip(COLUMNS, values):
+                    getattr(snapshot, name)[position] = value
+            elif found:
+                for name in COLUMNS:
+                    del getattr(snapshot, name)[position]
+            elif values is not None:
+                for name, value in zip(COLUMNS, values):
+                    getattr(snapshot, name).insert(position, value)
+            if old_category != new_category:
+                if old_category != NULL:
+                    question_ids = category_ids(old_category)
+                    del question_ids[bisect_left(question_ids, question_id)]
+                if new_category != NULL:
+                    question_ids = category_ids(new_category)
+                    question_ids.insert(
+                        bisect_left(question_ids, question_id), question_id
+                    )
+        for category in copied:
+            if not snapshot.by_category[category]:
+                del snapshot.by_category[category]
+        snapshot.revisions = revisions
+        snapshot.change_id = change_id
+        return snapshot
+
+
+class QuestionSnapshot:
+    """
+    Serves the question reads of the app from a Snapshot held in memory, when enabled
+    with the QUESTION_SNAPSHOT config. At most every `interval` seconds the revisions
+    of the content are read, and when the questions changed only the questions logged
+    in the question_changes table since the snapshot was built are read again. The
+    writes of this worker are seen by its next read through the question listeners.
+
+    The snapshot is loaded by create_app, so a server that loads the app before forking
+    its workers (gunicorn --preload) shares the pages of the snapshot between them until
+    its first refresh
+    """
+
+    def __init__(self, interval=1):
+        self.enabled = False
+        self.interval = interval
+        self._snapshot = None
+        self._expires_at = 0
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("QUESTION_SNAPSHOT", False)
+        self.interval = app.config.get("QUESTION_SNAPSHOT_INTERVAL", self.interval)
+        self._snapshot = None
+        if self.enabled:
+            with app.app_context():
+                self.get()
+
+    def get(self):
+        """
+        Returns the current snapshot, refreshed first when it was checked more than
+        `interval` seconds ago
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() < self._expires_at:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self._load()
+            elif time.monotonic() >= self._expires_at:
+                self._snapshot = self._refresh(self._snapshot)
+            self._expires_at = time.monotonic() + self.interval
+            return self._snapshot
+
+    def _revisions(self):
+        return dict(db.session.query(ContentRevision.name, ContentRevision.value))
+
+    def _load(self):
+        # Read before the questions, a change made in between is applied again later
+        revisions = self._revisions()
+        change_id = QuestionChange.last_id()
+        rows = db.session.query(*QUESTION_COLUMNS).all()
+        return Snapshot(rows, revisions, change_id)
+
+    def _refresh(self, snapshot):
+        revisions = self._revisions()
+        if revisions == snapshot.revisions:
+            return snapshot
+        # The changes logged after the snapshot were trimmed from the log
+        if snapshot.change_id < QuestionChange.first_id() - 1:
+            return self._load()
+        changes = QuestionChange.since(snapshot.change_id)
+        questions_changed = revisions.get("questions") != snapshot.revisions.get(
+            "questions"
+        )
+        # A bulk write, or questions written without logging their change
+        if any(question_id is None for _, question_id in changes) or (
+            questions_changed and not changes
+        ):
+            return self._load()
+        change_id = changes[-1][0] if changes else snapshot.change_id
+        question_ids = {question_id for _, question_id in changes}
+        rows = []
+        if question_ids:
+            rows = (
+                db.session.query(*QUESTION_COLUMNS)
+                .filter(Question.id.in_(question_ids))
+                .all()
+            )
+        deleted_ids = question_ids - {row[0] for row in rows}
+        return snapshot.apply(rows, deleted_ids, revisions, change_id)
+
+    def on_question_change(self, action, question):
+        self._expires_at = 0
+
+
+question_snapshot = QuestionSnapshot()
+question_listeners.append(question_snapshot.on_question_change)
+
+
+def questions_by_id(question_ids):
+    """
+    This function is used to get the questions of the ids in their order, from the
+    snapshot when it is enabled and else from the database in one query
+    """
+    if question_snapshot.enabled:
+        return question_snapshot.get().get_many(question_ids)
+    return project_questions_by_id(question_ids)
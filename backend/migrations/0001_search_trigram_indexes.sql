@@ -0,0 +1,14 @@
+-- Trigram indexes for the search of POST /questions.
+-- The search matches the term anywhere in the question or the answer with ILIKE,
+-- pg_trgm GIN indexes let PostgreSQL answer those filters without scanning the table
+-- and provide word_similarity() used to rank the results.
+--
+--   psql trivia < migrations/0001_search_trigram_indexes.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_questions_question_trgm
+    ON public.questions USING gin (question gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm
+    ON public.questions USING gin (answer gin_trgm_ops);
@@ -0,0 +1,28 @@
+-- Makes questions.category an integer foreign key to categories.id and adds the
+-- indexes used by the per category listing and the quiz sampling.
+-- Databases created by the old models have a varchar category column without a
+-- foreign key, databases restored from trivia.psql already have the integer column,
+-- the script converts both.
+--
+--   psql trivia < migrations/0002_category_integer_fk.sql
+
+BEGIN;
+
+ALTER TABLE public.questions
+    ALTER COLUMN category TYPE integer USING NULLIF(trim(category::text), '')::integer;
+
+ALTER TABLE public.questions DROP CONSTRAINT IF EXISTS category;
+ALTER TABLE public.questions DROP CONSTRAINT IF EXISTS questions_category_fkey;
+
+-- questions of categories that do not exist would break the foreign key
+UPDATE public.questions SET category = NULL
+    WHERE category NOT IN (SELECT id FROM public.categories);
+
+ALTER TABLE public.questions
+    ADD CONSTRAINT questions_category_fkey FOREIGN KEY (category)
+    REFERENCES public.categories(id) ON UPDATE CASCADE ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS ix_questions_category_id ON public.questions (category, id);
+CREATE INDEX IF NOT EXISTS ix_questions_difficulty ON public.questions (difficulty);
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- Revision counters bumped by every write of the questions and of the categories,
+-- used for the ETag of the GET endpoints. Seeding the rows avoids two first writes
+-- racing to create them.
+--
+--   psql trivia < migrations/0003_content_revisions.sql
+
+CREATE TABLE IF NOT EXISTS public.content_revisions (
+    name varchar PRIMARY KEY,
+    value integer NOT NULL DEFAULT 0
+);
+
+INSERT INTO public.content_revisions (name, value)
+    VALUES ('questions', 0), ('categories', 0)
+    ON CONFLICT (name) DO NOTHING;
@@ -0,0 +1,8 @@
+-- Normalized form of the answers, compared by POST /quizzes/answer. It is computed
+-- in Python (see normalize_answer in models.py), fill it for the existing questions
+-- with the CLI after the migration:
+--
+--   psql trivia < migrations/0004_normalized_answers.sql
+--   FLASK_APP=flaskr flask questions normalize-answers
+
+ALTER TABLE public.questions ADD COLUMN IF NOT EXISTS normalized_answer text;
@@ -0,0 +1,24 @@
+-- Players and their points per category, written in batches by flaskr/scores.py.
+--
+--   psql trivia < migrations/0005_scores.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.players (
+    id serial PRIMARY KEY,
+    name varchar NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS public.scores (
+    player_id integer NOT NULL REFERENCES public.players (id) ON DELETE CASCADE,
+    category integer NOT NULL
+        REFERENCES public.categories (id) ON UPDATE CASCADE ON DELETE CASCADE,
+    points integer NOT NULL DEFAULT 0,
+    answered integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id, category)
+);
+
+CREATE INDEX IF NOT EXISTS ix_scores_category_points
+    ON public.scores (category, points);
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- Change log of the questions, a row per question written (or one without
+-- question_id for a bulk write), read by the question snapshots of the workers
+-- to refresh only the questions that changed.
+--
+--   psql trivia < migrations/0006_question_changes.sql
+
+CREATE TABLE IF NOT EXISTS public.question_changes (
+    id serial PRIMARY KEY,
+    question_id integer
+);
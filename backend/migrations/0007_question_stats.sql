@@ -0,0 +1,23 @@
+-- Number of questions of each (category, difficulty), kept up to date by the
+-- question writes and served by GET /stats. A question without category or
+-- difficulty is counted under 0. `flask questions rebuild-stats` counts them again.
+--
+--   psql trivia < migrations/0007_question_stats.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.question_stats (
+    category integer NOT NULL,
+    difficulty integer NOT NULL,
+    questions integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (category, difficulty)
+);
+
+DELETE FROM public.question_stats;
+
+INSERT INTO public.question_stats (category, difficulty, questions)
+    SELECT coalesce(category, 0), coalesce(difficulty, 0), count(*)
+    FROM public.questions
+    GROUP BY 1, 2;
+
+COMMIT;
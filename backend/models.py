@@ -1,6 +1,29 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import csv
+import io
+import re
+import time
+import unicodedata
+from collections import Counter
+from functools import wraps
+from itertools import count
+from threading import Lock
+from flask import g, has_app_context
+from sqlalchemy import (
+    Column,
+    String,
+    Integer,
+    ForeignKey,
+    Index,
+    create_engine,
+    func,
+    inspect,
+    orm,
+    select,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import OperationalError
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_name = "trivia"
@@ -8,21 +31,239 @@ database_name = "trivia"
 database_path = "postgresql://{}:{}@{}/{}".format(
     "rafy", "admin", "localhost:5432", database_name
 )
+default_database_path = database_path
+
+"""
+ReplicaRouter
+    chooses the read replica of a read only request, round robin over the replicas
+    of SQLALCHEMY_REPLICA_URIS (bound as "replica_0", "replica_1", ...). A replica that
+    failed is skipped for `retry_after` seconds, without any replica the reads go to
+    the primary database
+"""
+
+
+class ReplicaRouter:
+    def __init__(self, retry_after=30):
+        self.retry_after = retry_after
+        self._turn = count()
+        self._failed_until = {}
+        self._lock = Lock()
+
+    def choose(self, app):
+        binds = [
+            bind
+            for bind in app.config.get("SQLALCHEMY_BINDS") or {}
+            if bind.startswith("replica_")
+        ]
+        if not binds:
+            return None
+        now = time.monotonic()
+        start = next(self._turn)
+        for offset in range(len(binds)):
+            bind = binds[(start + offset) % len(binds)]
+            if self._failed_until.get(bind, 0) <= now:
+                return bind
+        return None
+
+    def mark_failed(self, bind):
+        with self._lock:
+            self._failed_until[bind] = time.monotonic() + self.retry_after
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending the queries of a read only request (see read_only) to its replica,
+    flushes and everything outside read only requests go to the primary database
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        bind = getattr(g, "replica_bind", None) if has_app_context() else None
+        if bind is None or self._flushing:
+            return SignallingSession.get_bind(self, mapper, clause)
+        return db.get_engine(self.app, bind=bind)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_only(function):
+    """
+    Decorator running a function that only reads on a read replica, when the replica
+    fails the function is run again on the primary database
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if getattr(g, "replica_bind", None) is not None:
+            return function(*args, **kwargs)
+        g.replica_bind = replica_router.choose(db.get_app())
+        if g.replica_bind is None:
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        except OperationalError:
+            replica_router.mark_failed(g.replica_bind)
+            db.session.rollback()
+            g.replica_bind = None
+            return function(*args, **kwargs)
+        finally:
+            g.replica_bind = None
+
+    return wrapper
+
+
+# the objects are not expired on commit so a write does not reload the row it just wrote
+db = RoutingSQLAlchemy(session_options={"expire_on_commit": False})
+
+"""
+engine_options(database_path)
+    builds the SQLAlchemy engine options from the environment
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT: connections kept
+        by each worker, extra connections allowed under load and seconds to wait for one
+    DATABASE_POOL_RECYCLE: seconds after which a connection is replaced
+    DATABASE_POOL_PRE_PING: "true" to check connections before using them
+    DATABASE_STATEMENT_TIMEOUT: milliseconds a PostgreSQL statement may run
+    DATABASE_PGBOUNCER: "true" when connecting through pgbouncer in transaction mode,
+        pgbouncer pools the connections so the workers do not keep any, and the
+        statement timeout has to be set on the database role as pgbouncer rejects it
+"""
+
+
+def env_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+
+def engine_options(database_path):
+    options = {}
+    if database_path.startswith("sqlite"):
+        return options
+    if env_flag("DATABASE_PGBOUNCER"):
+        from sqlalchemy.pool import NullPool
+
+        options["poolclass"] = NullPool
+    else:
+        for option, variable in (
+            ("pool_size", "DATABASE_POOL_SIZE"),
+            ("max_overflow", "DATABASE_MAX_OVERFLOW"),
+            ("pool_timeout", "DATABASE_POOL_TIMEOUT"),
+        ):
+            if variable in os.environ:
+                options[option] = int(os.environ[variable])
+        statement_timeout = os.environ.get("DATABASE_STATEMENT_TIMEOUT")
+        if statement_timeout and database_path.startswith("postgres"):
+            options["connect_args"] = {
+                "options": "-c statement_timeout={}".format(int(statement_timeout))
+            }
+    if "DATABASE_POOL_RECYCLE" in os.environ:
+        options["pool_recycle"] = int(os.environ["DATABASE_POOL_RECYCLE"])
+    if env_flag("DATABASE_POOL_PRE_PING"):
+        options["pool_pre_ping"] = True
+    return options
 
-db = SQLAlchemy()
 
 """
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the database is the given database_path, else the SQLALCHEMY_DATABASE_URI of the app
+    config, else the DATABASE_URL environment variable, else the local trivia database.
+    The engine options are taken from SQLALCHEMY_ENGINE_OPTIONS when the config has it,
+    else from the environment (see engine_options). DATABASE_REPLICA_URLS is a comma
+    separated list of read replicas, kept in the SQLALCHEMY_REPLICA_URIS config and
+    bound as "replica_0", "replica_1", ... for the read only requests.
+    The tables are created when missing unless the CREATE_SCHEMA config is False, for
+    databases whose schema comes from the migrations or from the test fixtures
 """
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None):
+    if database_path is None:
+        database_path = app.config.get(
+            "SQLALCHEMY_DATABASE_URI",
+            os.environ.get("DATABASE_URL", default_database_path),
+        )
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(database_path))
+    replicas = os.environ.get("DATABASE_REPLICA_URLS", "")
+    app.config.setdefault(
+        "SQLALCHEMY_REPLICA_URIS", [uri for uri in replicas.split(",") if uri]
+    )
+    binds = app.config.get("SQLALCHEMY_BINDS") or {}
+    for index, replica_path in enumerate(app.config["SQLALCHEMY_REPLICA_URIS"]):
+        binds["replica_{}".format(index)] = replica_path
+    app.config["SQLALCHEMY_BINDS"] = binds
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if app.config.get("CREATE_SCHEMA", True):
+        # the replicas get their schema from the primary database
+        db.create_all(bind=None)
+
+
+def get_pool_stats():
+    """
+    Returns the state of the connection pool of the primary database
+    """
+    pool = db.get_engine().pool
+    stats = {"pool": type(pool).__name__, "status": pool.status()}
+    if hasattr(pool, "checkedout"):
+        stats.update(
+            {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            }
+        )
+    return stats
+
+
+"""
+question_listeners
+    callables notified with (action, question) after a question change is committed,
+    action is "insert", "update" or "delete" and question is the formatted question,
+    or action is "reload" and question is None when many questions changed at once
+"""
+question_listeners = []
+
+
+def notify_question_listeners(action, question):
+    for listener in question_listeners:
+        listener(action, question)
+
+
+"""
+category_listeners
+    callables notified without arguments after a category change is committed
+"""
+category_listeners = []
+
+
+def notify_category_listeners():
+    for listener in category_listeners:
+        listener()
+
+
+"""
+normalize_answer
+    folds an answer for comparison: accents and apostrophes removed, case folded,
+    other punctuation replaced by spaces and runs of whitespace collapsed
+"""
+APOSTROPHE_PATTERN = re.compile("['\u2019]")
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+
+def normalize_answer(answer):
+    if answer is None:
+        return None
+    decomposed = unicodedata.normalize("NFKD", answer)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    stripped = APOSTROPHE_PATTERN.sub("", stripped)
+    return NON_WORD_PATTERN.sub(" ", stripped.casefold()).strip()
 
 
 """
@@ -33,29 +274,157 @@ Question
 
 class Question(db.Model):
     __tablename__ = "questions"
+    __table_args__ = (
+        # serves the per category listing and the quiz sampling, both ordered by id
+        Index("ix_questions_category_id", "category", "id"),
+        Index("ix_questions_difficulty", "difficulty"),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(
+        Integer, ForeignKey("categories.id", onupdate="CASCADE", ondelete="SET NULL"),
+    )
     difficulty = Column(Integer)
+    # the answer as compared by POST /quizzes/answer, see normalize_answer
+    normalized_answer = Column(String)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
         self.answer = answer
         self.category = category
         self.difficulty = difficulty
+        self.normalized_answer = normalize_answer(answer)
+
+    def counted_as(self):
+        """
+        Returns the (category, difficulty) the question is counted in by QuestionStat,
+        as saved before the changes of the question not yet flushed
+        """
+        state = inspect(self)
+        saved = []
+        for name in ("category", "difficulty"):
+            history = state.attrs[name].history
+            if history.deleted:
+                saved.append(history.deleted[0])
+            elif history.unchanged or not history.added:
+                saved.append(getattr(self, name))
+            else:
+                # changed after it expired, the saved value was never loaded
+                with db.session.no_autoflush:
+                    row = (
+                        db.session.query(Question.category, Question.difficulty)
+                        .filter(Question.id == self.id)
+                        .one()
+                    )
+                return tuple(row)
+        return tuple(saved)
 
     def insert(self):
+        self.normalized_answer = normalize_answer(self.answer)
         db.session.add(self)
+        db.session.flush()
+        question = self.format()
+        ContentRevision.bump("questions")
+        QuestionChange.record([self.id])
+        QuestionStat.add({(self.category, self.difficulty): 1})
         db.session.commit()
+        notify_question_listeners("insert", question)
 
     def update(self):
+        counted_as = self.counted_as()
+        # a question of a session already removed is saved by this one
+        db.session.add(self)
+        self.normalized_answer = normalize_answer(self.answer)
+        question = self.format()
+        ContentRevision.bump("questions")
+        QuestionChange.record([self.id])
+        if (self.category, self.difficulty) != counted_as:
+            QuestionStat.add({counted_as: -1, (self.category, self.difficulty): 1})
         db.session.commit()
+        notify_question_listeners("update", question)
 
     def delete(self):
+        counted_as = self.counted_as()
+        question = self.format()
         db.session.delete(self)
+        ContentRevision.bump("questions")
+        QuestionChange.record([self.id])
+        QuestionStat.add({counted_as: -1})
+        db.session.commit()
+        notify_question_listeners("delete", question)
+
+    @classmethod
+    def delete_many(cls, ids):
+        """
+        Delete the questions of the ids in one transaction and return the deleted
+        questions, the ids of no question are ignored
+        """
+        columns = (cls.id, cls.question, cls.answer, cls.category, cls.difficulty)
+        questions = [
+            dict(zip(("id", "question", "answer", "category", "difficulty"), row))
+            for row in db.session.query(*columns).filter(cls.id.in_(ids))
+        ]
+        if not questions:
+            return []
+        deleted_ids = [question["id"] for question in questions]
+        cls.query.filter(cls.id.in_(deleted_ids)).delete(synchronize_session=False)
+        ContentRevision.bump("questions")
+        QuestionChange.record(deleted_ids)
+        QuestionStat.add(
+            Counter(
+                (question["category"], question["difficulty"]) for question in questions
+            ),
+            -1,
+        )
+        db.session.commit()
+        for question in questions:
+            notify_question_listeners("delete", question)
+        return questions
+
+    @classmethod
+    def bulk_insert(cls, rows):
+        """
+        Insert many questions (dicts of question, answer, category and difficulty)
+        in one transaction, with COPY on PostgreSQL and executemany elsewhere
+        """
+        if not rows:
+            return
+        connection = db.session.connection()
+        if connection.dialect.name == "postgresql":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(
+                    [
+                        row["question"],
+                        row["answer"],
+                        row["category"],
+                        row["difficulty"],
+                        normalize_answer(row["answer"]),
+                    ]
+                )
+            buffer.seek(0)
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                "COPY questions (question, answer, category, difficulty, "
+                "normalized_answer) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        else:
+            connection.execute(
+                cls.__table__.insert(),
+                [
+                    dict(row, normalized_answer=normalize_answer(row["answer"]))
+                    for row in rows
+                ],
+            )
+        ContentRevision.bump("questions")
+        QuestionChange.record([None])
+        QuestionStat.add(Counter((row["category"], row["difficulty"]) for row in rows))
         db.session.commit()
+        notify_question_listeners("reload", None)
 
     def format(self):
         return {
@@ -82,6 +451,284 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        ContentRevision.bump("categories")
+        db.session.commit()
+        notify_category_listeners()
+
+    def update(self):
+        ContentRevision.bump("categories")
+        db.session.commit()
+        notify_category_listeners()
+
+    def delete(self):
+        """
+        Deletes the category in one transaction with the change of its questions, left
+        without category as the ON DELETE SET NULL of PostgreSQL does, and of their
+        counts in QuestionStat
+        """
+        counts = dict(
+            db.session.query(Question.difficulty, func.count(Question.id))
+            .filter(Question.category == self.id)
+            .group_by(Question.difficulty)
+        )
+        if counts:
+            Question.query.filter(Question.category == self.id).update(
+                {Question.category: None}, synchronize_session="evaluate"
+            )
+            ContentRevision.bump("questions")
+            QuestionChange.record([None])
+            QuestionStat.add(
+                {
+                    (self.id, difficulty): number
+                    for difficulty, number in counts.items()
+                },
+                -1,
+            )
+            QuestionStat.add(
+                {(None, difficulty): number for difficulty, number in counts.items()}
+            )
+        db.session.delete(self)
+        ContentRevision.bump("categories")
+        db.session.commit()
+        notify_category_listeners()
+        if counts:
+            notify_question_listeners("reload", None)
+
     def format(self):
         return {"id": self.id, "type": self.type}
 
+
+"""
+Player
+
+"""
+
+
+class Player(db.Model):
+    __tablename__ = "players"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+
+    def __init__(self, name):
+        self.name = name
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def format(self):
+        return {"id": self.id, "name": self.name}
+
+
+"""
+Score
+    points and answered questions of a player in a category, written in batches by
+    flaskr.scores so a submission does not cost a commit
+"""
+
+
+class Score(db.Model):
+    __tablename__ = "scores"
+    __table_args__ = (
+        # serves the loading of the leaderboard of a category
+        Index("ix_scores_category_points", "category", "points"),
+    )
+
+    player_id = Column(
+        Integer, ForeignKey("players.id", ondelete="CASCADE"), primary_key=True
+    )
+    category = Column(
+        Integer,
+        ForeignKey("categories.id", onupdate="CASCADE", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    points = Column(Integer, nullable=False, default=0)
+    answered = Column(Integer, nullable=False, default=0)
+
+    def format(self):
+        return {
+            "player_id": self.player_id,
+            "category": self.category,
+            "points": self.points,
+            "answered": self.answered,
+        }
+
+
+"""
+ContentRevision
+    revision counter of a kind of content ("questions" or "categories"), bumped in the
+    transaction of every write so the responses built from that content can be
+    versioned without reading the content itself
+"""
+
+
+class ContentRevision(db.Model):
+    __tablename__ = "content_revisions"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, name):
+        """
+        Increments the revision in the current transaction, the caller commits
+        """
+        updated = cls.query.filter(cls.name == name).update(
+            {cls.value: cls.value + 1}, synchronize_session=False
+        )
+        if not updated:
+            db.session.add(cls(name=name, value=1))
+
+    @classmethod
+    def get(cls, name):
+        value = db.session.query(cls.value).filter(cls.name == name).scalar()
+        return value or 0
+
+
+"""
+QuestionChange
+    change log of the questions, every question write adds the ids of the questions it
+    changed in its transaction, or a row without id when many questions changed at once,
+    so the question snapshots of the workers only read the questions that changed.
+    It is written by every process, a snapshot could not tell the writes it missed,
+    and keeps the last QUESTION_CHANGES_KEPT changes (default 10000)
+"""
+
+
+class QuestionChange(db.Model):
+    __tablename__ = "question_changes"
+
+    id = Column(Integer, primary_key=True)
+    question_id = Column(Integer)
+
+    @classmethod
+    def record(cls, question_ids):
+        """
+        Logs the change of the questions in the current transaction and trims the log,
+        the caller commits
+        """
+        db.session.execute(
+            cls.__table__.insert(),
+            [{"question_id": question_id} for question_id in question_ids],
+        )
+        kept = db.get_app().config.get("QUESTION_CHANGES_KEPT", 10000)
+        db.session.execute(cls.trim(kept))
+
+    @classmethod
+    def trim(cls, kept):
+        """
+        Returns the statement deleting the changes logged before the last `kept` ones
+        """
+        table = cls.__table__
+        last_id = select([func.max(table.c.id)]).as_scalar()
+        return table.delete().where(table.c.id <= last_id - kept)
+
+    @classmethod
+    def first_id(cls):
+        return db.session.query(func.min(cls.id)).scalar() or 0
+
+    @classmethod
+    def last_id(cls):
+        return db.session.query(func.max(cls.id)).scalar() or 0
+
+    @classmethod
+    def since(cls, change_id):
+        """
+        Returns the (change id, question id) logged after the change id, in order
+        """
+        return (
+            db.session.query(cls.id, cls.question_id)
+            .filter(cls.id > change_id)
+            .order_by(cls.id)
+            .all()
+        )
+
+
+"""
+QuestionStat
+    number of questions of each (category, difficulty), changed in the transaction of
+    every question write so the statistics are read without counting the questions.
+    A question without category or difficulty is counted under 0.
+    QuestionStat.rebuild() counts them again from the questions
+"""
+
+
+class QuestionStat(db.Model):
+    __tablename__ = "question_stats"
+
+    category = Column(Integer, primary_key=True)
+    difficulty = Column(Integer, primary_key=True)
+    questions = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def add(cls, counts, sign=1):
+        """
+        Adds the {(category, difficulty): number of questions} counts in the current
+        transaction, the caller commits
+        """
+        table = cls.__table__
+        rows = [
+            {
+                "category": category or 0,
+                "difficulty": difficulty or 0,
+                "questions": sign * number,
+            }
+            for (category, difficulty), number in counts.items()
+            if number
+        ]
+        if not rows:
+            return
+        connection = db.session.connection()
+        if connection.dialect.name == "postgresql":
+            # two first writes of a pair can not both insert it
+            statement = postgresql.insert(table)
+            connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[table.c.category, table.c.difficulty],
+                    set_={
+                        "questions": table.c.questions + statement.excluded.questions
+                    },
+                ),
+                rows,
+            )
+            return
+        for row in rows:
+            updated = connection.execute(
+                table.update()
+                .where(table.c.category == row["category"])
+                .where(table.c.difficulty == row["difficulty"])
+                .values(questions=table.c.questions + row["questions"])
+            ).rowcount
+            if not updated:
+                connection.execute(table.insert(), row)
+
+    @classmethod
+    def count_all(cls):
+        """
+        Returns the statement filling the table with the counts of the questions
+        """
+        category = func.coalesce(Question.category, 0)
+        difficulty = func.coalesce(Question.difficulty, 0)
+        counts = select([category, difficulty, func.count(Question.id)]).group_by(
+            category, difficulty
+        )
+        return cls.__table__.insert().from_select(
+            ["category", "difficulty", "questions"], counts
+        )
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Counts the questions of each (category, difficulty) again and commits, returns
+        the number of pairs
+        """
+        db.session.execute(cls.__table__.delete())
+        db.session.execute(cls.count_all())
+        # the cached responses of GET /stats are built again
+        ContentRevision.bump("questions")
+        db.session.commit()
+        return cls.query.count()
+
@@ -1,24 +1,195 @@
+import gzip
+import io
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import zlib
+from unittest import mock
+from flask import Flask, _app_ctx_stack, jsonify
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import StaticPool
 
+import benchmark
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.admission import Call, admission_control
+from flaskr.answers import answer_checker
+from flaskr.bulk import ImportFailed, import_questions
+from flaskr.categories import category_registry
+from flaskr.http_cache import content_etag
+from flaskr.quiz_sessions import MemorySessionStore, quiz_sessions
+from flaskr.response_cache import MemoryResponseStore, response_cache
+from flaskr.scores import scores
+from flaskr.instrumentation import capture_queries
+from flaskr.search import MemorySearchBackend, SQLSearchBackend
+from flaskr.serialization import response_encoder
+from flaskr.snapshot import COLUMNS, Snapshot, question_snapshot
+from models import (
+    engine_options,
+    db,
+    notify_question_listeners,
+    ContentRevision,
+    Question,
+    QuestionChange,
+    QuestionStat,
+    Category,
+    Player,
+    Score,
+)
 
+"""
+Test database
+    the schema is built and the rows of trivia.psql are loaded once per run in an
+    in-memory SQLite database, or TEST_DATABASE_URL is a database that already has them,
+    such as a PostgreSQL database copied from a template:
+        createdb -T trivia_template trivia_test
+    Each test runs in a transaction of its own connection, rolled back after the test,
+    and the commits of the app only release a savepoint of that transaction
+"""
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL", "sqlite://")
 
-class TriviaTestCase(unittest.TestCase):
+
+def load_psql_dump(connection, path):
+    """
+    This function is used to insert the rows of the COPY blocks of a pg_dump file
+    """
+    tables = db.Model.metadata.tables
+    with open(path) as dump:
+        lines = iter(dump.read().split("\n"))
+    for line in lines:
+        if not line.startswith("COPY "):
+            continue
+        table = tables[line.split()[1].split(".")[-1]]
+        columns = line[line.index("(") + 1 : line.index(")")].split(", ")
+        rows = []
+        for row in iter(lambda: next(lines), "\\."):
+            values = [None if value == "\\N" else value for value in row.split("\t")]
+            rows.append(dict(zip(columns, values)))
+        connection.execute(table.insert(), rows)
+
+
+def load_test_data(connection):
+    """
+    This function is used to build the schema and load the rows of trivia.psql in an
+    empty database
+    """
+    db.Model.metadata.create_all(connection)
+    load_psql_dump(connection, "trivia.psql")
+    # filled by migrations/0007_question_stats.sql on PostgreSQL
+    connection.execute(QuestionStat.count_all())
+
+
+def restart_savepoint(session, transaction):
+    # a commit or rollback of the app ended the savepoint of the test, start another
+    if transaction.nested and not transaction._parent.nested:
+        session.begin_nested()
+
+
+class DatabaseFixture:
+    """
+    The database of the tests, see TEST_DATABASE_URL
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.engine = None
+
+    def start(self):
+        if self.engine is not None:
+            return
+        if not self.url.startswith("sqlite"):
+            self.engine = create_engine(self.url)
+            return
+        # one connection shared by the threads, or each would get an empty database
+        self.engine = create_engine(
+            self.url, poolclass=StaticPool, connect_args={"check_same_thread": False},
+        )
+
+        # pysqlite starts and ends transactions itself, which breaks the savepoints
+        @event.listens_for(self.engine, "connect")
+        def connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(self.engine, "begin")
+        def begin(connection):
+            connection.execute("BEGIN")
+
+        with self.engine.begin() as connection:
+            load_test_data(connection)
+
+    def stop(self):
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+
+    def begin(self):
+        """
+        Binds db.session to a new transaction until rollback()
+        """
+        self.start()
+        self.connection = self.engine.connect()
+        self.transaction = self.connection.begin()
+        factory = db.create_session({"bind": self.connection, "binds": {}})
+        event.listen(factory, "after_transaction_end", restart_savepoint)
+
+        def session():
+            session = factory()
+            session.begin_nested()
+            return session
+
+        self.session = db.session
+        db.session = orm.scoped_session(
+            session, scopefunc=_app_ctx_stack.__ident_func__
+        )
+
+    def rollback(self):
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
+        # the caches of the workers saw the rows written by the test
+        notify_question_listeners("reload", None)
+        category_registry.invalidate()
+
+
+test_database = DatabaseFixture(TEST_DATABASE_URL)
+
+
+def tearDownModule():
+    test_database.stop()
+
+
+def app_config(**config):
+    """
+    This function is used to build the config of an app on the test database
+    """
+    config.setdefault("SQLALCHEMY_DATABASE_URI", TEST_DATABASE_URL)
+    config.setdefault("CREATE_SCHEMA", False)
+    config.setdefault("SCORE_FLUSH_INTERVAL", 0)
+    config.setdefault("CATEGORY_CACHE_TTL", 300)
+    return config
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """This class runs each test in a transaction rolled back after it"""
+
+    def setUp(self):
+        test_database.begin()
+        self.addCleanup(test_database.rollback)
+
+
+class TriviaTestCase(DatabaseTestCase):
     """This class represents the trivia test case"""
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        super().setUp()
+        self.app = create_app(app_config())
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            "rafy", "admin", "localhost:5432", self.database_name
-        )
-        setup_db(self.app, self.database_path)
         self.question = Question(
             question="What is the capital of egypt ?",
             answer="cario",
@@ -26,13 +197,6 @@ class TriviaTestCase(unittest.TestCase):
             difficulty=2,
         )
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
     def tearDown(self):
         """Executed after reach test"""
         pass
@@ -51,6 +215,55 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(data["categories"])
 
+    def test_get_categories_cached_until_invalidated(self):
+        # Arrange
+        self.client().get("/categories")
+        category = Category(type="Music")
+        db.session.add(category)
+        db.session.commit()
+        # Act
+        cached = dict(category_registry.all())
+        category_registry.invalidate()
+        reloaded = dict(category_registry.all())
+        db.session.delete(category)
+        db.session.commit()
+        category_registry.invalidate()
+        # Assert
+        self.assertNotIn("Music", cached.values())
+        self.assertIn("Music", reloaded.values())
+
+    def test_get_categories_after_category_write(self):
+        # Arrange
+        first = self.client().get("/categories")
+        etag = first.headers["ETag"]
+        # Act
+        Category(type="Music").insert()
+        changed = self.client().get("/categories", headers={"If-None-Match": etag})
+        revalidated = self.client().get(
+            "/categories", headers={"If-None-Match": changed.headers["ETag"]}
+        )
+        # Assert
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.headers["X-Cache"], "MISS")
+        self.assertIn("Music", json.loads(changed.data)["categories"].values())
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_get_categories_after_category_write_of_other_worker(self):
+        # Arrange
+        first = json.loads(self.client().get("/categories").data)
+        with self.app.app_context():
+            # a write of another worker, its listeners do not run in this one
+            db.session.add(Category(type="Music"))
+            ContentRevision.bump("categories")
+            db.session.commit()
+        # Act
+        res = self.client().get("/categories")
+        data = json.loads(res.data)
+        # Assert
+        self.assertNotIn("Music", first["categories"].values())
+        self.assertEqual(res.headers["X-Cache"], "MISS")
+        self.assertIn("Music", data["categories"].values())
+
     def test_get_paginated_questions(self):
         # Act
         res = self.client().get("/questions")
@@ -63,6 +276,99 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data["current_category"])
         self.assertTrue(len(data["categories"]))
 
+    def test_get_questions_answers_304_until_questions_change(self):
+        # Arrange
+        first = self.client().get("/questions")
+        etag = first.headers["ETag"]
+        # Act
+        unchanged = self.client().get("/questions", headers={"If-None-Match": etag})
+        self.question.insert()
+        changed = self.client().get("/questions", headers={"If-None-Match": etag})
+        self.question.delete()
+        # Assert
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("must-revalidate", first.headers["Cache-Control"])
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(unchanged.headers["ETag"], etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+
+    def test_get_questions_served_from_response_cache_until_questions_change(self):
+        # Arrange
+        first = self.client().get("/questions?page=2")
+        # Act
+        cached = self.client().get("/questions?page=2")
+        self.question.insert()
+        changed = self.client().get("/questions?page=2")
+        self.question.delete()
+        # Assert
+        self.assertEqual(first.headers["X-Cache"], "MISS")
+        self.assertEqual(cached.headers["X-Cache"], "HIT")
+        self.assertEqual(cached.data, first.data)
+        self.assertEqual(changed.headers["X-Cache"], "MISS")
+        self.assertEqual(
+            json.loads(changed.data)["total_questions"],
+            json.loads(first.data)["total_questions"] + 1,
+        )
+
+    def test_get_questions_counts_the_writes_of_other_workers(self):
+        # Arrange
+        first = json.loads(self.client().get("/questions").data)
+        with self.app.app_context():
+            # a write of another worker, its listeners do not run in this one
+            db.session.add(self.question)
+            ContentRevision.bump("questions")
+            db.session.commit()
+        # Act
+        res = self.client().get("/questions")
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.headers["X-Cache"], "MISS")
+        self.assertEqual(data["total_questions"], first["total_questions"] + 1)
+
+    def test_response_cache_with_external_store(self):
+        # Arrange
+        class FakeStore:
+            def __init__(self):
+                self.values = {}
+
+            def get(self, key):
+                return self.values.get(key)
+
+            def set(self, key, value, ex=None):
+                self.values[key] = value
+
+            def delete(self, key):
+                self.values.pop(key, None)
+
+        store = FakeStore()
+        app = create_app(app_config(RESPONSE_CACHE_STORE=store))
+        # Act
+        first = app.test_client().get("/categories")
+        cached = app.test_client().get("/categories")
+        response_cache.init_app(self.app)
+        # Assert
+        self.assertEqual(len(store.values), 1)
+        self.assertEqual(cached.headers["X-Cache"], "HIT")
+        self.assertEqual(cached.data, first.data)
+        self.assertEqual(cached.mimetype, "application/json")
+
+    def test_memory_response_store_is_bounded_by_bytes(self):
+        # Arrange
+        store = MemoryResponseStore(max_bytes=100)
+        # Act
+        store.set("a", b"x" * 40)
+        store.set("b", b"x" * 40)
+        store.get("a")
+        store.set("c", b"x" * 40)
+        store.set("d", b"x" * 200)
+        # Assert
+        self.assertIsNotNone(store.get("a"))
+        self.assertIsNone(store.get("b"))
+        self.assertIsNotNone(store.get("c"))
+        self.assertIsNone(store.get("d"))
+        self.assertLessEqual(store.size, 100)
+
     def test_404_sent_requesting_beyond_valid_page_for_questions(self):
         # Act
         res = self.client().get("/questions?page=10000")
@@ -73,6 +379,19 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["error"], 404)
         self.assertEqual(data["message"], "resource not found")
 
+    def test_get_paginated_questions_after_id(self):
+        # Arrange
+        first_page = json.loads(self.client().get("/questions").data)
+        last_id = first_page["questions"][-1]["id"]
+        # Act
+        res = self.client().get(f"/questions?after_id={last_id}")
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertTrue(all(q["id"] > last_id for q in data["questions"]))
+        self.assertEqual(data["total_questions"], first_page["total_questions"])
+
     def test_delete_question(self):
         """
         To keep the database consistent and to be able to run this test many times i will add a question then delete
@@ -124,6 +443,191 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data["questions"]))
         self.assertTrue(data["total_questions"])
 
+    def test_add_new_question_stores_integer_category(self):
+        # Arrange
+        question = {
+            "question": self.question.question,
+            "category": "3",
+            "answer": self.question.answer,
+            "difficulty": "2",
+        }
+        # Act
+        res = self.client().post("/questions", json=question)
+        data = json.loads(res.data)
+        created = Question.query.get(data["created"])
+        category, difficulty = created.category, created.difficulty
+        created.delete()
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(category, 3)
+        self.assertEqual(difficulty, 2)
+
+    def test_import_questions_in_bulk(self):
+        # Arrange
+        rows = [
+            {
+                "question": "Bulk imported one?",
+                "answer": "a",
+                "category": 1,
+                "difficulty": 1,
+            },
+            {
+                "question": "Bulk imported two?",
+                "answer": "b",
+                "category": 2,
+                "difficulty": 5,
+            },
+            {"question": "Bulk imported invalid?", "answer": "c", "category": 1000},
+        ]
+        body = "\n".join(json.dumps(row) for row in rows) + "\nnot json\n"
+        # Act
+        res = self.client().post(
+            "/questions/import", data=body, content_type="application/x-ndjson"
+        )
+        data = json.loads(res.data)
+        imported = Question.query.filter(Question.question.like("Bulk imported%"))
+        imported_questions = [question.question for question in imported]
+        imported.delete(synchronize_session=False)
+        db.session.commit()
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["imported"], 2)
+        self.assertEqual(data["invalid"], 2)
+        self.assertEqual([error["line"] for error in data["errors"]], [3, 4])
+        self.assertEqual(
+            sorted(imported_questions), ["Bulk imported one?", "Bulk imported two?"]
+        )
+
+    def test_422_import_reports_where_it_stopped(self):
+        # Arrange
+        row = {
+            "question": "Bulk failed?",
+            "answer": "a",
+            "category": 1,
+            "difficulty": 1,
+        }
+        body = (json.dumps(row) + "\n").encode() * 2 + b"\xff\n"
+        rows = io.StringIO((json.dumps(row) + "\n") * 3)
+        # Act
+        res = self.client().post(
+            "/questions/import", data=body, content_type="application/x-ndjson"
+        )
+        data = json.loads(res.data)
+        with self.app.app_context():
+            with mock.patch.object(
+                Question, "bulk_insert", side_effect=[None, SQLAlchemyError("full")]
+            ):
+                with self.assertRaises(ImportFailed) as failed:
+                    import_questions(rows, batch_size=1)
+            imported = Question.query.filter(Question.question == "Bulk failed?")
+        # Assert
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["imported"], 0)
+        self.assertEqual(data["line"], 1)
+        self.assertEqual(imported.count(), 0)
+        self.assertEqual(failed.exception.imported, 1)
+        self.assertEqual(failed.exception.line, 2)
+
+    def test_export_questions_in_bulk(self):
+        # Act
+        res = self.client().get("/questions/export")
+        lines = res.data.decode("utf-8").splitlines()
+        exported = [json.loads(line) for line in lines]
+        csv_res = self.client().get("/questions/export?format=csv")
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertEqual(len(exported), Question.query.count())
+        self.assertIn("Who discovered penicillin?", [q["question"] for q in exported])
+        self.assertEqual(csv_res.mimetype, "text/csv")
+        self.assertEqual(len(csv_res.data.decode("utf-8").splitlines()), len(lines) + 1)
+
+    def test_add_and_delete_question_with_minimal_response(self):
+        # Arrange
+        question = {
+            "question": self.question.question,
+            "category": self.question.category,
+            "answer": self.question.answer,
+            "difficulty": self.question.difficulty,
+        }
+        total_questions = Question.query.count()
+        # Act
+        created = self.client().post("/questions?return=minimal", json=question)
+        created_data = json.loads(created.data)
+        deleted = self.client().delete(
+            "/questions/{}".format(created_data["created"]),
+            headers={"Prefer": "return=minimal"},
+        )
+        deleted_data = json.loads(deleted.data)
+        # Assert
+        self.assertEqual(created.status_code, 200)
+        self.assertEqual(created.headers["Preference-Applied"], "return=minimal")
+        self.assertNotIn("questions", created_data)
+        self.assertEqual(created_data["total_questions"], total_questions + 1)
+        self.assertEqual(deleted.status_code, 200)
+        self.assertNotIn("questions", deleted_data)
+        self.assertEqual(deleted_data["deleted"], created_data["created"])
+        self.assertEqual(deleted_data["total_questions"], total_questions)
+
+    def test_get_questions_in_batch(self):
+        # Act
+        res = self.client().post("/questions/batch-get", json={"ids": [22, 5, 100000]})
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question["id"] for question in data["questions"]], [22, 5])
+        self.assertEqual(data["missing"], [100000])
+
+    def test_delete_questions_in_batch(self):
+        # Arrange
+        with self.app.app_context():
+            ids = []
+            for _ in range(2):
+                question = Question(
+                    question="Batch question?", answer="a", category=1, difficulty=1
+                )
+                question.insert()
+                ids.append(question.id)
+        # Act
+        res = self.client().post(
+            "/questions/batch-delete", json={"ids": ids + [100000]}
+        )
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(data["deleted"]), ids)
+        self.assertNotIn("questions", data)
+        self.assertEqual(res.headers["Preference-Applied"], "return=minimal")
+        with self.app.app_context():
+            self.assertEqual(Question.query.filter(Question.id.in_(ids)).count(), 0)
+
+    def test_delete_questions_in_batch_with_representation(self):
+        # Arrange
+        with self.app.app_context():
+            question = Question(
+                question="Batch question?", answer="a", category=1, difficulty=1
+            )
+            question.insert()
+            question_id = question.id
+        # Act
+        res = self.client().post(
+            "/questions/batch-delete",
+            json={"ids": [question_id]},
+            headers={"Prefer": "return=representation"},
+        )
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["deleted"], [question_id])
+        self.assertTrue(len(data["questions"]))
+
+    def test_422_delete_questions_in_batch_without_ids(self):
+        # Act
+        res = self.client().post("/questions/batch-delete", json={"ids": []})
+        # Assert
+        self.assertEqual(res.status_code, 422)
+
     def test_405_if_question_adding_not_allowed(self):
         # Arrange
         # convert the question object to Json object
@@ -185,6 +689,62 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(len(data["questions"]), 0)
         self.assertEqual(data["total_questions"], 0)
 
+    def test_get_question_search_matches_answers(self):
+        # ACT
+        search_term = {"searchTerm": "fleming"}
+        res = self.client().post("/questions", json=search_term)
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], 1)
+        self.assertEqual(data["questions"][0]["answer"], "Alexander Fleming")
+
+    def test_memory_search_backend_matches_sql_backend(self):
+        # Arrange
+        memory_backend = MemorySearchBackend()
+        sql_backend = SQLSearchBackend()
+        with self.app.app_context():
+            # Act
+            memory_results = [
+                memory_backend.search(term, 1, 10) for term in ("the", "wh", "100%")
+            ]
+            sql_results = [
+                sql_backend.search(term, 1, 10) for term in ("the", "wh", "100%")
+            ]
+            self.question.insert()
+            question = self.question.format()
+            memory_backend.on_question_change("insert", question)
+            inserted, _ = memory_backend.search("capital of egypt", 1, 10)
+            self.question.delete()
+            memory_backend.on_question_change("delete", question)
+            deleted, _ = memory_backend.search("capital of egypt", 1, 10)
+        # Assert
+        self.assertEqual(memory_results, sql_results)
+        self.assertIn(question, inserted)
+        self.assertNotIn(question, deleted)
+
+    def test_fast_json_responses_match_jsonify(self):
+        # Arrange
+        payloads = [
+            {
+                "success": True,
+                "categories": {
+                    index: "Category {}".format(index) for index in range(12)
+                },
+                "questions": [{"id": 1, "question": 'Say "hi"\n', "answer": "/"}],
+            },
+            {"questions": [{"id": 2, "question": "Qu'est-ce que l'été ?"}]},
+            {"success": False, "total_questions": 2 ** 70, "current_category": None},
+        ]
+        with self.app.test_request_context():
+            for payload in payloads:
+                # Act
+                fast = response_encoder.jsonify(payload)
+                expected = jsonify(payload)
+                # Assert
+                self.assertEqual(fast.get_data(), expected.get_data())
+                self.assertEqual(fast.mimetype, expected.mimetype)
+
     def test_get_question_per_category(self):
         # Act
         res = self.client().get("/categories/1/questions")
@@ -221,6 +781,815 @@ class TriviaTestCase(unittest.TestCase):
         # validate that the returned question of the same category I have selected
         self.assertEqual(data["question"]["category"], 6)
 
+    def test_get_quiz_skips_previous_questions(self):
+        # Act
+        posted_data = {
+            "previous_questions": [20, 21],
+            "quiz_category": {"type": "Science", "id": "1"},
+        }
+        res = self.client().post("/quizzes", json=posted_data)
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["question"]["id"], 22)
+
+    def test_get_quiz_without_remaining_questions(self):
+        # Act
+        posted_data = {
+            "previous_questions": [20, 21, 22],
+            "quiz_category": {"type": "Science", "id": "1"},
+        }
+        res = self.client().post("/quizzes", json=posted_data)
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertNotIn("question", data)
+
+    def test_get_quiz_reads_only_the_chosen_question(self):
+        # Arrange
+        posted_data = {"previous_questions": [20], "quiz_category": {"id": 0}}
+        self.client().post("/quizzes", json=posted_data)
+        # Act
+        with capture_queries() as queries:
+            res = self.client().post("/quizzes", json=posted_data)
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(data["question"]["id"], 20)
+        self.assertEqual(len([query for query in queries if "questions" in query]), 1)
+
+    def test_400_get_quiz_with_invalid_previous_questions(self):
+        # Act
+        posted_data = {
+            "previous_questions": [20, "abc"],
+            "quiz_category": {"type": "Science", "id": "1"},
+        }
+        res = self.client().post("/quizzes", json=posted_data)
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_check_quiz_answer(self):
+        # Arrange
+        self.question.answer = "Édith Piaf"
+        self.question.insert()
+        url = "/quizzes/answer"
+        # Act
+        right = self.client().post(
+            url, json={"question_id": self.question.id, "answer": "  edith PIAF!"}
+        )
+        typo = self.client().post(
+            url, json={"question_id": self.question.id, "answer": "edit piaf"}
+        )
+        self.app.config["ANSWER_MAX_EDITS"] = 2
+        answer_checker.init_app(self.app)
+        fuzzy = self.client().post(
+            url, json={"question_id": self.question.id, "answer": "edit piaf"}
+        )
+        answer_checker.init_app(create_app(app_config()))
+        self.question.delete()
+        # Assert
+        self.assertEqual(right.status_code, 200)
+        self.assertTrue(json.loads(right.data)["correct"])
+        self.assertEqual(json.loads(right.data)["answer"], "Édith Piaf")
+        self.assertFalse(json.loads(typo.data)["correct"])
+        self.assertTrue(json.loads(fuzzy.data)["correct"])
+
+    def test_404_check_answer_of_unknown_question(self):
+        # Act
+        res = self.client().post(
+            "/quizzes/answer", json={"question_id": 100000, "answer": "cario"}
+        )
+        # Assert
+        self.assertEqual(res.status_code, 404)
+
+    def test_get_quiz_without_answers(self):
+        # Arrange
+        app = create_app(app_config(QUIZ_INCLUDE_ANSWERS=False))
+        posted_data = {
+            "previous_questions": [],
+            "quiz_category": {"type": "Science", "id": "1"},
+        }
+        # Act
+        res = app.test_client().post("/quizzes", json=posted_data)
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["question"]["question"])
+        self.assertNotIn("answer", data["question"])
+
+    def test_generate_quiz_with_difficulty_ramp(self):
+        # Arrange
+        spec = {"count": 5, "difficulties": "ramp", "seed": 42}
+        # Act
+        res = self.client().post("/quizzes/generate", json=spec)
+        again = self.client().post("/quizzes/generate", json=spec)
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], 5)
+        ids = [question["id"] for question in data["questions"]]
+        difficulties = [question["difficulty"] for question in data["questions"]]
+        self.assertEqual(len(set(ids)), 5)
+        self.assertEqual(difficulties, sorted(difficulties))
+        self.assertEqual(json.loads(again.data), data)
+
+    def test_generated_quiz_sees_new_questions(self):
+        # Arrange
+        self.client().post("/quizzes/generate", json={"count": 1})
+        with self.app.app_context():
+            self.question.difficulty = 9
+            self.question.insert()
+            question_id = self.question.id
+        spec = {"count": 1, "categories": {"3": 1}, "difficulties": {"9": 1}}
+        # Act
+        res = self.client().post("/quizzes/generate", json=spec)
+        data = json.loads(res.data)
+        with self.app.app_context():
+            Question.query.get(question_id).delete()
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["questions"][0]["id"], question_id)
+
+    def test_400_generate_quiz_with_invalid_spec(self):
+        # Act
+        res = self.client().post("/quizzes/generate", json={"count": 0})
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_400_generate_quiz_with_boolean_spec_values(self):
+        for spec in (
+            {"count": True},
+            {"count": 1, "seed": True},
+            {"count": 1, "categories": {"1": True}},
+        ):
+            with self.subTest(spec=spec):
+                # Act
+                res = self.client().post("/quizzes/generate", json=spec)
+                data = json.loads(res.data)
+                # Assert
+                self.assertEqual(res.status_code, 400)
+                self.assertEqual(data["success"], False)
+
+    def test_scores_are_buffered_and_ranked(self):
+        # Arrange
+        app = create_app(app_config())
+        client = app.test_client()
+        players = [
+            json.loads(
+                client.post("/players", json={"name": "Player {}".format(name)}).data
+            )["player"]["id"]
+            for name in ("one", "two")
+        ]
+        # Act
+        for player_id, category, points in (
+            (players[0], 1, 2),
+            (players[1], 1, 3),
+            (players[0], 2, 5),
+        ):
+            client.post(
+                "/scores",
+                json={"player_id": player_id, "category": category, "points": points},
+            )
+        with app.app_context():
+            rows_before_flush = Score.query.filter(Score.player_id.in_(players)).count()
+            written = scores.flush()
+            rows = {
+                (score.player_id, score.category): score.points
+                for score in Score.query.filter(Score.player_id.in_(players))
+            }
+        science = json.loads(client.get("/leaderboard?category=1").data)
+        overall = json.loads(client.get("/leaderboard").data)
+        with app.app_context():
+            Score.query.filter(Score.player_id.in_(players)).delete(
+                synchronize_session=False
+            )
+            Player.query.filter(Player.id.in_(players)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+        scores.init_app(self.app)
+        # Assert
+        self.assertEqual(rows_before_flush, 0)
+        self.assertEqual(written, 3)
+        self.assertEqual(
+            rows, {(players[0], 1): 2, (players[1], 1): 3, (players[0], 2): 5},
+        )
+        self.assertEqual(
+            [entry["player_id"] for entry in science["leaderboard"]], players[::-1]
+        )
+        self.assertEqual(
+            [entry["points"] for entry in overall["leaderboard"]][:2], [7, 3]
+        )
+
+    def test_scores_written_by_a_forked_worker(self):
+        # Arrange
+        app = create_app(app_config(SCORE_FLUSH_INTERVAL=3600))
+        client = app.test_client()
+        player_id = json.loads(client.post("/players", json={"name": "Forked"}).data)[
+            "player"
+        ]["id"]
+        # the thread of the process that created the app does not run after the fork
+        scores._thread = threading.Thread(target=None)
+        scores._pid = os.getpid() + 1
+        # Act
+        res = client.post(
+            "/scores", json={"player_id": player_id, "category": 1, "points": 2}
+        )
+        started = scores._thread.is_alive()
+        scores.stop()
+        with app.app_context():
+            rows = Score.query.filter(Score.player_id == player_id).count()
+        scores.init_app(self.app)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(started)
+        self.assertEqual(rows, 1)
+
+    def test_scores_written_on_stop_without_thread(self):
+        # Arrange
+        app = create_app(app_config())
+        client = app.test_client()
+        player_id = json.loads(client.post("/players", json={"name": "Stopped"}).data)[
+            "player"
+        ]["id"]
+        client.post(
+            "/scores", json={"player_id": player_id, "category": 1, "points": 2}
+        )
+        # Act
+        scores.stop()
+        with app.app_context():
+            rows = Score.query.filter(Score.player_id == player_id).count()
+        scores.init_app(self.app)
+        # Assert
+        self.assertEqual(rows, 1)
+
+    def test_404_score_of_unknown_player(self):
+        # Act
+        res = self.client().post(
+            "/scores", json={"player_id": 100000, "category": 1, "points": 1}
+        )
+        # Assert
+        self.assertEqual(res.status_code, 404)
+
+    def test_question_snapshot_serves_reads_from_memory(self):
+        # Arrange
+        database_page = json.loads(self.client().get("/categories/1/questions").data)
+        database_search = json.loads(
+            self.client().post("/questions", json={"searchTerm": "title"}).data
+        )
+        app = create_app(
+            app_config(QUESTION_SNAPSHOT=True, QUESTION_SNAPSHOT_INTERVAL=3600)
+        )
+        client = app.test_client()
+        posted_data = {
+            "previous_questions": [20, 21],
+            "quiz_category": {"type": "Science", "id": "1"},
+        }
+        # Act
+        with capture_queries() as queries:
+            snapshot_page = json.loads(client.get("/categories/1/questions").data)
+            snapshot_search = json.loads(
+                client.post("/questions", json={"searchTerm": "title"}).data
+            )
+            quiz = json.loads(client.post("/quizzes", json=posted_data).data)
+        with app.app_context():
+            self.question.category = 1
+            self.question.insert()
+        changed_page = json.loads(client.get("/categories/1/questions").data)
+        self.question.delete()
+        deleted_page = json.loads(client.get("/categories/1/questions").data)
+        question_snapshot.init_app(self.app)
+        # Assert
+        self.assertEqual([query for query in queries if "questions" in query], [])
+        self.assertEqual(snapshot_page, database_page)
+        self.assertEqual(snapshot_search, database_search)
+        self.assertEqual(quiz["question"]["id"], 22)
+        self.assertEqual(changed_page["questions"][-1]["answer"], self.question.answer)
+        self.assertEqual(
+            changed_page["total_questions"], database_page["total_questions"] + 1
+        )
+        self.assertEqual(deleted_page, database_page)
+
+    def test_question_changes_logged_and_trimmed_for_the_snapshot(self):
+        # Arrange
+        writer = create_app(app_config(QUESTION_CHANGES_KEPT=2))
+        app = create_app(
+            app_config(QUESTION_SNAPSHOT=True, QUESTION_SNAPSHOT_INTERVAL=0)
+        )
+        questions = [
+            Question(
+                question="Question {}".format(number),
+                answer="a",
+                category=1,
+                difficulty=1,
+            )
+            for number in range(3)
+        ]
+        # Act
+        with writer.app_context():
+            # writes of a process without snapshot, such as the import command
+            for question in questions:
+                db.session.add(question)
+                db.session.flush()
+                ContentRevision.bump("questions")
+                QuestionChange.record([question.id])
+                db.session.commit()
+            kept = [question_id for _, question_id in QuestionChange.since(0)]
+        with app.app_context():
+            snapshot = question_snapshot.get()
+        question_snapshot.init_app(self.app)
+        # Assert
+        self.assertEqual(kept, [question.id for question in questions[1:]])
+        self.assertEqual(
+            [
+                question["question"]
+                for question in snapshot.get_many(
+                    [question.id for question in questions]
+                )
+            ],
+            ["Question 0", "Question 1", "Question 2"],
+        )
+
+    def test_snapshot_changes_applied_as_a_full_load(self):
+        # Arrange
+        rows = [
+            (1, "One", "a", 1, 1),
+            (3, "Three", "b", 1, 2),
+            (5, "Five", "c", 2, None),
+            (7, "Seven", "d", None, 3),
+        ]
+        snapshot = Snapshot(rows, {}, 0)
+        changed = [
+            (3, "Moved", "B", 2, 2),
+            (4, "Four", "e", 3, 1),
+            (7, "Seven", "d", 1, 3),
+        ]
+        expected = Snapshot(
+            [rows[0], changed[0], changed[1], changed[2]], {"questions": 1}, 4
+        )
+        # Act
+        applied = snapshot.apply(changed, {5, 9}, {"questions": 1}, 4)
+        # Assert
+        for name in COLUMNS:
+            self.assertEqual(getattr(applied, name), getattr(expected, name))
+        self.assertEqual(applied.by_category, expected.by_category)
+        self.assertEqual((applied.revisions, applied.change_id), ({"questions": 1}, 4))
+        self.assertEqual(list(snapshot.ids), [1, 3, 5, 7])
+        self.assertEqual(list(snapshot.category_ids(1)), [1, 3])
+
+    def test_responses_compressed_once_when_accepted(self):
+        # Arrange
+        headers = {"Accept-Encoding": "gzip"}
+        plain = self.client().get("/questions")
+        # Act
+        with mock.patch.object(
+            zlib, "compressobj", wraps=zlib.compressobj
+        ) as compressobj:
+            compressed = self.client().get("/questions", headers=headers)
+            cached = self.client().get("/questions", headers=headers)
+        small = self.client().get("/categories", headers=headers)
+        export = self.client().get("/questions/export", headers=headers)
+        # Assert
+        self.assertEqual(compressed.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", compressed.headers["Vary"])
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertEqual(cached.headers["X-Cache"], "HIT")
+        self.assertEqual(cached.data, compressed.data)
+        self.assertEqual(compressobj.call_count, 1)
+        self.assertNotIn("Content-Encoding", small.headers)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(export.headers["Content-Encoding"], "gzip")
+        self.assertEqual(
+            gzip.decompress(export.data), self.client().get("/questions/export").data
+        )
+
+    def test_stats_follow_question_writes(self):
+        # Arrange
+        before = json.loads(self.client().get("/stats").data)
+        # Act
+        self.question.insert()
+        inserted = json.loads(self.client().get("/stats").data)
+        self.question.category = 1
+        self.question.update()
+        updated = json.loads(self.client().get("/stats").data)
+        self.question.delete()
+        deleted = json.loads(self.client().get("/stats").data)
+        with self.app.app_context():
+            total_questions = Question.query.count()
+        # Assert
+        self.assertEqual(before["total_questions"], total_questions)
+        self.assertEqual(
+            sum(before["questions_per_category"].values()), total_questions
+        )
+        categories = before["questions_per_category"]
+        self.assertEqual(
+            inserted["questions_per_category"],
+            dict(categories, **{"3": categories["3"] + 1}),
+        )
+        self.assertEqual(
+            updated["questions_per_category"],
+            dict(categories, **{"1": categories["1"] + 1}),
+        )
+        self.assertEqual(
+            inserted["questions_per_difficulty"]["2"],
+            before["questions_per_difficulty"]["2"] + 1,
+        )
+        self.assertEqual(deleted, before)
+
+    def test_rebuild_stats_after_drift(self):
+        # Arrange
+        before = json.loads(self.client().get("/stats").data)
+        with self.app.app_context():
+            QuestionStat.query.delete()
+            ContentRevision.bump("questions")
+            db.session.commit()
+        drifted = json.loads(self.client().get("/stats").data)
+        # Act
+        result = self.app.test_cli_runner().invoke(args=["questions", "rebuild-stats"])
+        rebuilt = json.loads(self.client().get("/stats").data)
+        # Assert
+        self.assertEqual(drifted["total_questions"], 0)
+        self.assertIn("Counted", result.output)
+        self.assertEqual(rebuilt, before)
+
+    def test_stats_follow_questions_saved_by_the_session(self):
+        # Arrange
+        before = json.loads(self.client().get("/stats").data)
+        with self.app.app_context():
+            db.session.add(self.question)
+            db.session.commit()
+            QuestionStat.add({(self.question.category, self.question.difficulty): 1})
+            db.session.commit()
+        # Act
+        with self.app.app_context():
+            self.question.delete()
+        deleted = json.loads(self.client().get("/stats").data)
+        # Assert
+        self.assertEqual(deleted, before)
+
+    def test_stats_follow_category_deletes(self):
+        # Arrange
+        category = Category(type="Music")
+        category.insert()
+        self.question.category = category.id
+        self.question.insert()
+        # Act
+        with self.app.app_context():
+            category.delete()
+            counted = {
+                (stat.category, stat.difficulty): stat.questions
+                for stat in QuestionStat.query
+                if stat.questions
+            }
+            QuestionStat.rebuild()
+            recounted = {
+                (stat.category, stat.difficulty): stat.questions
+                for stat in QuestionStat.query
+            }
+            question = Question.query.get(self.question.id)
+        # Assert
+        self.assertIsNone(question.category)
+        self.assertEqual(counted, recounted)
+
+    def test_503_when_admission_queue_is_full(self):
+        # Arrange
+        app = create_app(
+            app_config(
+                ADMISSION_MAX_CONCURRENCY=1,
+                ADMISSION_QUEUE_SIZE=1,
+                ADMISSION_QUEUE_TIMEOUT=0.01,
+                ADMISSION_RETRY_AFTER=2,
+            )
+        )
+        client = app.test_client()
+        posted_data = {"previous_questions": [], "quiz_category": {"id": 0}}
+        # Act
+        admission_control.acquire(admission_control.slots)
+        shed = client.post("/quizzes", json=posted_data)
+        admission_control.release(admission_control.slots)
+        admitted = client.post("/quizzes", json=posted_data)
+        metrics = client.get("/metrics").data.decode()
+        admission_control.init_app(self.app)
+        # Assert
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(shed.headers["Retry-After"], "2")
+        self.assertEqual(json.loads(shed.data)["success"], False)
+        self.assertEqual(admitted.status_code, 200)
+        self.assertIn('trivia_admission_rejected_total{reason="timeout"}', metrics)
+        self.assertIn("trivia_admission_in_flight 0", metrics)
+
+    def test_export_keeps_its_admission_slot_while_streamed(self):
+        # Arrange
+        app = create_app(app_config(ADMISSION_MAX_CONCURRENCY=1))
+        client = app.test_client()
+        # Act
+        res = client.get("/questions/export", buffered=False)
+        streaming = admission_control.in_flight
+        body = b"".join(res.response)
+        res.close()
+        sent = admission_control.in_flight
+        admission_control.init_app(self.app)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(body)
+        self.assertEqual(streaming, 1)
+        self.assertEqual(sent, 0)
+
+    def test_503_when_coalesced_request_waits_too_long(self):
+        # Arrange
+        app = create_app(app_config(ADMISSION_QUEUE_TIMEOUT=0.01))
+        client = app.test_client()
+        with app.test_request_context("/stats"):
+            key = "/stats?#" + content_etag(("questions", "categories"))
+        # a request running the view for ever
+        admission_control._calls[key] = Call()
+        self.addCleanup(admission_control._calls.clear)
+        # Act
+        res = client.get("/stats")
+        admission_control.init_app(self.app)
+        # Assert
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(json.loads(res.data)["success"], False)
+
+    def test_identical_concurrent_reads_run_once(self):
+        # Arrange
+        app = Flask("single_flight")
+        started = threading.Event()
+        finish = threading.Event()
+        calls = []
+
+        @app.route("/slow")
+        @admission_control.coalesced()
+        def slow():
+            calls.append(1)
+            started.set()
+            finish.wait(5)
+            return jsonify({"calls": len(calls)})
+
+        coalesced = admission_control.coalesced_requests
+        responses = []
+
+        def get():
+            responses.append(app.test_client().get("/slow?page=1"))
+
+        threads = [threading.Thread(target=get) for _ in range(2)]
+        # Act
+        threads[0].start()
+        started.wait(5)
+        threads[1].start()
+        deadline = time.monotonic() + 5
+        while (
+            admission_control.coalesced_requests == coalesced
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.001)
+        finish.set()
+        for thread in threads:
+            thread.join(5)
+        # Assert
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(responses[0].data, responses[1].data)
+
+    def test_concurrent_reads_of_other_revisions_run_apart(self):
+        # Arrange
+        app = Flask("single_flight")
+        finish = threading.Event()
+        calls = []
+
+        @app.route("/slow")
+        @admission_control.coalesced("questions")
+        def slow():
+            calls.append(1)
+            finish.wait(5)
+            return jsonify({"calls": len(calls)})
+
+        responses = []
+
+        def get():
+            responses.append(app.test_client().get("/slow?page=1"))
+
+        threads = [threading.Thread(target=get) for _ in range(2)]
+        # Act
+        with mock.patch(
+            "flaskr.admission.content_etag", side_effect=["questions1", "questions2"]
+        ):
+            for thread in threads:
+                thread.start()
+            deadline = time.monotonic() + 5
+            while len(calls) < 2 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            finish.set()
+            for thread in threads:
+                thread.join(5)
+        # Assert
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+
+    def test_health_reports_pool_stats(self):
+        # Act
+        res = self.client().get("/health")
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertTrue(data["pool"]["pool"])
+
+    def test_server_timing_and_metrics(self):
+        # Act
+        res = self.client().get("/questions")
+        metrics = self.client().get("/metrics")
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("db;dur=", res.headers["Server-Timing"])
+        self.assertIn("serialize;dur=", res.headers["Server-Timing"])
+        self.assertEqual(metrics.status_code, 200)
+        self.assertIn(
+            'trivia_requests_total{method="GET",route="/questions",status="200"}',
+            metrics.data.decode(),
+        )
+
+    def test_get_questions_reads_no_full_table_nor_n_plus_one(self):
+        # Act
+        with capture_queries() as queries:
+            res = self.client().get("/questions?page=1")
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(queries.full_table_reads("questions"), [])
+        self.assertEqual(queries.repeated(), [])
+
+    def test_engine_options_from_environment(self):
+        # Arrange
+        environment = {
+            "DATABASE_POOL_SIZE": "20",
+            "DATABASE_MAX_OVERFLOW": "5",
+            "DATABASE_POOL_RECYCLE": "1800",
+            "DATABASE_POOL_PRE_PING": "true",
+            "DATABASE_STATEMENT_TIMEOUT": "3000",
+        }
+        database_path = "postgresql://{}:{}@{}/{}".format(
+            "rafy", "admin", "localhost:5432", "trivia_test"
+        )
+        # Act
+        with mock.patch.dict(os.environ, environment):
+            options = engine_options(database_path)
+        with mock.patch.dict(os.environ, {"DATABASE_PGBOUNCER": "true"}):
+            pgbouncer_options = engine_options(database_path)
+        # Assert
+        self.assertEqual(options["pool_size"], 20)
+        self.assertEqual(options["max_overflow"], 5)
+        self.assertEqual(options["pool_recycle"], 1800)
+        self.assertEqual(options["pool_pre_ping"], True)
+        self.assertEqual(
+            options["connect_args"], {"options": "-c statement_timeout=3000"}
+        )
+        self.assertEqual(pgbouncer_options["poolclass"].__name__, "NullPool")
+
+    def test_quiz_session_serves_each_question_once(self):
+        # Arrange
+        posted_data = {"quiz_category": {"type": "Science", "id": "1"}}
+        res = self.client().post("/quizzes/sessions", json=posted_data)
+        session = json.loads(res.data)
+        # Act
+        steps = [
+            json.loads(
+                self.client()
+                .post("/quizzes/sessions/{}/next".format(session["session_id"]))
+                .data
+            )
+            for _ in range(4)
+        ]
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(session["total_questions"], 3)
+        self.assertEqual(
+            sorted(step["question"]["id"] for step in steps[:3]), [20, 21, 22]
+        )
+        self.assertEqual([step["remaining_questions"] for step in steps], [2, 1, 0, 0])
+        self.assertNotIn("question", steps[3])
+
+    def test_quiz_session_serves_next_questions_in_batch(self):
+        # Arrange
+        posted_data = {"quiz_category": {"type": "Science", "id": "1"}}
+        res = self.client().post("/quizzes/sessions", json=posted_data)
+        url = "/quizzes/sessions/{}/next?count=2".format(
+            json.loads(res.data)["session_id"]
+        )
+        # Act
+        first = json.loads(self.client().post(url).data)
+        second = json.loads(self.client().post(url).data)
+        # Assert
+        self.assertEqual(len(first["questions"]), 2)
+        self.assertEqual(first["remaining_questions"], 1)
+        self.assertEqual(len(second["questions"]), 1)
+        self.assertEqual(second["remaining_questions"], 0)
+        self.assertEqual(
+            sorted(q["id"] for q in first["questions"] + second["questions"]),
+            [20, 21, 22],
+        )
+
+    def test_quiz_session_kept_alive_by_its_questions(self):
+        # Arrange
+        posted_data = {"quiz_category": {"type": "Science", "id": "1"}}
+        session = json.loads(
+            self.client().post("/quizzes/sessions", json=posted_data).data
+        )
+        url = "/quizzes/sessions/{}/next".format(session["session_id"])
+        now = time.monotonic()
+        # Act
+        with mock.patch.object(time, "monotonic", return_value=now + 3000):
+            first = self.client().post(url)
+        with mock.patch.object(time, "monotonic", return_value=now + 6000):
+            second = self.client().post(url)
+        with mock.patch.object(time, "monotonic", return_value=now + 10000):
+            expired = self.client().post(url)
+        # Assert
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(json.loads(second.data)["remaining_questions"], 1)
+        self.assertEqual(expired.status_code, 404)
+
+    def test_quiz_sessions_evicted_with_their_position(self):
+        # Arrange
+        quiz_sessions.store = MemorySessionStore(max_sessions=2)
+        self.addCleanup(quiz_sessions.init_app, self.app)
+        first, _ = quiz_sessions.start_ids([1, 2, 3])
+        second, _ = quiz_sessions.start_ids([4, 5, 6])
+        with mock.patch(
+            "flaskr.quiz_sessions.questions_by_id",
+            side_effect=lambda ids: [{"id": question_id} for question_id in ids],
+        ):
+            taken = quiz_sessions.take(first, 1)
+            # Act
+            third, _ = quiz_sessions.start_ids([7, 8, 9])
+            evicted = quiz_sessions.take(second, 1)
+            kept = quiz_sessions.take(first, 2)
+        # Assert
+        self.assertEqual(taken[1], 2)
+        self.assertIsNone(evicted)
+        self.assertEqual(kept[1], 0)
+        self.assertEqual(len(kept[0]), 2)
+
+    def test_concurrent_quiz_session_requests_get_distinct_questions(self):
+        # Arrange
+        session_id, total_questions = quiz_sessions.start_ids(range(1, 201))
+        served = []
+
+        def questions_by_id(question_ids):
+            # the primary key read of the questions, other requests run meanwhile
+            time.sleep(0.001)
+            return [{"id": question_id} for question_id in question_ids]
+
+        def take():
+            while True:
+                questions, _ = quiz_sessions.take(session_id, 3)
+                if not questions:
+                    return
+                served.extend(question["id"] for question in questions)
+
+        threads = [threading.Thread(target=take) for _ in range(8)]
+        # Act
+        with mock.patch("flaskr.quiz_sessions.questions_by_id", questions_by_id):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+        # Assert
+        self.assertEqual(sorted(served), list(range(1, total_questions + 1)))
+
+    def test_get_quiz_questions_in_batch(self):
+        # Act
+        posted_data = {
+            "previous_questions": [20],
+            "quiz_category": {"type": "Science", "id": "1"},
+            "count": 5,
+        }
+        res = self.client().post("/quizzes", json=posted_data)
+        data = json.loads(res.data)
+        all_categories = dict(posted_data, quiz_category={"id": 0}, count=3)
+        with capture_queries() as queries:
+            many = json.loads(self.client().post("/quizzes", json=all_categories).data)
+        # Assert
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(q["id"] for q in data["questions"]), [21, 22])
+        self.assertEqual(data["remaining_questions"], 0)
+        self.assertEqual(len(many["questions"]), 3)
+        self.assertEqual(len([query for query in queries if "questions" in query]), 1)
+
+    def test_404_next_question_of_unknown_quiz_session(self):
+        # Act
+        res = self.client().post("/quizzes/sessions/unknown/next")
+        data = json.loads(res.data)
+        # Assert
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+
     def test_400_post_invalid_category_for_quiz(self):
         # Act
         posted_data = {
@@ -236,6 +1605,283 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["message"], "bad request")
 
 
+class ReplicaTestCase(unittest.TestCase):
+    """This class checks the replicas on databases of its own"""
+
+    def test_reads_go_to_replicas_with_fallback_to_primary(self):
+        # Arrange
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = "sqlite:///" + os.path.join(directory, "primary.db")
+        replica = "sqlite:///" + os.path.join(directory, "replica.db")
+        missing = "sqlite:///" + os.path.join(directory, "missing", "replica.db")
+        for path, category_type in ((replica, "Replica"), (primary, "Primary")):
+            app = create_app({"SQLALCHEMY_DATABASE_URI": path})
+            with app.app_context():
+                db.session.add(Category(type=category_type))
+                db.session.commit()
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": primary,
+                "SQLALCHEMY_REPLICA_URIS": [missing, replica],
+                "CATEGORY_CACHE_TTL": 0,
+                # the databases differ at the same revision, nothing is cached
+                "RESPONSE_CACHE_MAX_BYTES": 0,
+            }
+        )
+        client = app.test_client()
+        # Act
+        served_by = [
+            list(json.loads(client.get("/categories").data)["categories"].values())
+            for _ in range(3)
+        ]
+        with app.app_context():
+            db.session.add(Category(type="Written"))
+            db.session.commit()
+            primary_types = [category.type for category in Category.query.all()]
+        # Assert
+        self.assertEqual(sorted(served_by[:2]), [["Primary"], ["Replica"]])
+        self.assertEqual(served_by[2], ["Replica"])
+        self.assertEqual(primary_types, ["Primary", "Written"])
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    """This class runs the benchmark on a tiny bank to keep it working"""
+
+    def test_benchmark_reports_every_endpoint(self):
+        # Arrange
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, "results.json")
+        # Act
+        status = benchmark.main(
+            ["--questions", "50", "--requests", "5", "--output", output]
+        )
+        with open(output) as results_file:
+            results = json.load(results_file)
+        regression_status = benchmark.main(
+            ["--questions", "50", "--requests", "5", "--mode", "client"]
+            + ["--baseline", output, "--max-regression", "1000"]
+        )
+        # Assert
+        self.assertEqual(status, 0)
+        self.assertEqual(regression_status, 0)
+        self.assertIn("POST /quizzes", results)
+        self.assertEqual(results["GET /categories"]["client"]["errors"], 0)
+        self.assertEqual(results["GET /categories"]["server"]["requests"], 5)
+
+
+try:
+    from starlette.testclient import TestClient
+    from flaskr.asgi import create_asgi_app
+except ImportError:
+    create_asgi_app = None
+
+
+@unittest.skipIf(create_asgi_app is None, "requirements-asgi.txt is not installed")
+class AsgiParityTestCase(unittest.TestCase):
+    """This class checks that the ASGI app answers as the Flask app"""
+
+    requests = [
+        ("GET", "/categories", None),
+        ("GET", "/questions", None),
+        ("GET", "/questions?page=2", None),
+        ("GET", "/questions?after_id=10", None),
+        ("GET", "/questions?page=10000", None),
+        ("GET", "/questions?page=abc", None),
+        ("GET", "/questions?after_id=abc&page=2", None),
+        ("GET", "/categories/1/questions?page=abc", None),
+        ("GET", "/categories/1/questions", None),
+        ("GET", "/categories/1000/questions", None),
+        ("POST", "/questions", {"searchTerm": "penicillin"}),
+        ("POST", "/questions", {"searchTerm": "dfnaksdfdilkjlf3jiojjojjd"}),
+        (
+            "POST",
+            "/questions",
+            {"question": "no answer", "category": 1, "difficulty": 1},
+        ),
+        ("POST", "/questions/45", {"searchTerm": "title"}),
+        ("DELETE", "/questions/999999", None),
+        (
+            "POST",
+            "/quizzes",
+            {
+                "previous_questions": [20, 21],
+                "quiz_category": {"type": "Science", "id": "1"},
+            },
+        ),
+        (
+            "POST",
+            "/quizzes",
+            {"previous_questions": [28], "quiz_category": {"type": "", "id": ""}},
+        ),
+        (
+            "POST",
+            "/quizzes",
+            {
+                "previous_questions": [20, "abc"],
+                "quiz_category": {"type": "Science", "id": "1"},
+            },
+        ),
+        ("POST", "/questions?page=abc", {"searchTerm": "title"}),
+    ]
+
+    # run on a copy of the test database for each app, then the tables are compared
+    writes = [
+        (
+            "POST",
+            "/questions",
+            {
+                "question": "Who wrote it?",
+                "answer": "Me",
+                "difficulty": 2,
+                "category": 3,
+            },
+            {},
+        ),
+        (
+            "POST",
+            "/questions?return=minimal",
+            {
+                "question": "Who read it?",
+                "answer": "You",
+                "difficulty": 1,
+                "category": 3,
+            },
+            {},
+        ),
+        ("DELETE", "/questions/5", None, {"Prefer": "return=minimal"}),
+        ("DELETE", "/questions/9", None, {}),
+        ("DELETE", "/questions/24", None, {}),
+    ]
+    written_tables = [
+        "questions",
+        "content_revisions",
+        "question_changes",
+        "question_stats",
+    ]
+
+    def setUp(self):
+        # both apps read the same database, the connections of the ASGI app do not
+        # share an in-memory one, so the test rows are loaded in a file instead
+        self.database_path = TEST_DATABASE_URL
+        if self.database_path.startswith("sqlite"):
+            self.database_path = self.sqlite_database()
+        self.app = create_app(
+            {"SQLALCHEMY_DATABASE_URI": self.database_path, "CREATE_SCHEMA": False}
+        )
+        self.asgi_client = self.start_asgi_app(self.database_path)
+
+    def sqlite_database(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = "sqlite:///" + os.path.join(directory, "trivia.db")
+        engine = create_engine(path)
+        with engine.begin() as connection:
+            load_test_data(connection)
+        engine.dispose()
+        return path
+
+    def start_asgi_app(self, database_path):
+        client = TestClient(create_asgi_app(database_path))
+        client.__enter__()
+        self.addCleanup(client.__exit__, None, None, None)
+        return client
+
+    def read_tables(self, database_path):
+        engine = create_engine(database_path)
+        tables = db.Model.metadata.tables
+        with engine.connect() as connection:
+            rows = {
+                name: [
+                    tuple(row)
+                    for row in connection.execute(
+                        tables[name].select().order_by(*tables[name].primary_key)
+                    )
+                ]
+                for name in self.written_tables
+            }
+        engine.dispose()
+        return rows
+
+    def test_responses_match_flask_app(self):
+        for method, url, body in self.requests:
+            with self.subTest(method=method, url=url, body=body):
+                # Act
+                flask_res = self.app.test_client().open(url, method=method, json=body)
+                asgi_res = self.asgi_client.request(method, url, json=body)
+                # Assert
+                self.assertEqual(asgi_res.status_code, flask_res.status_code)
+                self.assertEqual(asgi_res.json(), json.loads(flask_res.data))
+
+    def test_writes_match_flask_app(self):
+        if not TEST_DATABASE_URL.startswith("sqlite"):
+            self.skipTest("the writes are compared on two copies of a SQLite database")
+        # Arrange
+        flask_path = self.sqlite_database()
+        asgi_path = self.sqlite_database()
+        flask_client = create_app(
+            {"SQLALCHEMY_DATABASE_URI": flask_path, "CREATE_SCHEMA": False}
+        ).test_client()
+        asgi_client = self.start_asgi_app(asgi_path)
+        # Act
+        responses = []
+        for method, url, body, headers in self.writes:
+            flask_res = flask_client.open(
+                url, method=method, json=body, headers=headers
+            )
+            asgi_res = asgi_client.request(method, url, json=body, headers=headers)
+            responses.append((method, url, flask_res, asgi_res))
+        flask_tables = self.read_tables(flask_path)
+        asgi_tables = self.read_tables(asgi_path)
+        # Assert
+        for method, url, flask_res, asgi_res in responses:
+            with self.subTest(method=method, url=url):
+                self.assertEqual(asgi_res.status_code, flask_res.status_code)
+                self.assertEqual(asgi_res.json(), json.loads(flask_res.data))
+                self.assertEqual(
+                    asgi_res.headers.get("Preference-Applied"),
+                    flask_res.headers.get("Preference-Applied"),
+                )
+        for name in self.written_tables:
+            with self.subTest(table=name):
+                self.assertEqual(asgi_tables[name], flask_tables[name])
+
+    def test_random_quiz_matches_flask_app(self):
+        # Arrange
+        body = {
+            "previous_questions": [20, 21],
+            "quiz_category": {"type": "Science", "id": "1"},
+        }
+        exhausted = {
+            "previous_questions": [16, 17, 18, 19],
+            "quiz_category": {"type": "Art", "id": "2"},
+        }
+        # Act
+        flask_quizzes = [
+            json.loads(self.app.test_client().post("/quizzes", json=body).data)
+            for _ in range(10)
+        ]
+        asgi_quizzes = [
+            self.asgi_client.post("/quizzes", json=body).json() for _ in range(10)
+        ]
+        flask_exhausted = json.loads(
+            self.app.test_client().post("/quizzes", json=exhausted).data
+        )
+        asgi_exhausted = self.asgi_client.post("/quizzes", json=exhausted).json()
+        # Assert
+        with self.app.app_context():
+            science = {
+                question.id: question.format()
+                for question in Question.query.filter(Question.category == 1)
+            }
+        for quiz in flask_quizzes + asgi_quizzes:
+            self.assertEqual(set(quiz), {"success", "question"})
+            self.assertNotIn(quiz["question"]["id"], body["previous_questions"])
+            self.assertEqual(quiz["question"], science[quiz["question"]["id"]])
+        self.assertEqual(asgi_exhausted, flask_exhausted)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()